@@ -0,0 +1,131 @@
+"""
+Compares the JSON decoders on large order and offer payloads.
+
+    python benchmarks/decode_json.py [--repeat 20]
+
+For each payload it reports the time to decode the body and the time to
+decode and parse it into models, for:
+
+* "text+Decimal": `resp.text` decoded with every float as a `Decimal`
+  (`bol.retailer.models.parse_json`);
+* "json+Decimal": the default, the same on `resp.content` bytes;
+* "json+float": the standard library with floats;
+* "orjson": orjson (floats) on `resp.content` bytes, when installed.
+"""
+import argparse
+import json
+import timeit
+
+from bol.retailer.api import RetailerAPI
+from bol.retailer.decoders import JSONDecoder, OrjsonDecoder, orjson
+from bol.retailer.models import OffersResponse, Orders, parse_json
+
+
+def order(i):
+    return {
+        "orderId": str(1000000000 + i),
+        "pickUpPoint": False,
+        "orderPlacedDateTime": "2019-04-29T16:18:21+02:00",
+        "shipmentDetails": {
+            "firstName": "Hans", "surname": "de Grote",
+            "streetName": "Skywalkerstraat", "houseNumber": "21",
+            "zipCode": "1234AB", "city": "PLATOONDORP", "countryCode": "NL",
+            "email": "hans@example.com", "language": "nl",
+        },
+        "billingDetails": {
+            "firstName": "Pieter", "surname": "Post",
+            "streetName": "Skywalkerstraat", "houseNumber": "21",
+            "zipCode": "1234AB", "city": "PLATOONDORP", "countryCode": "NL",
+            "email": "pieter@example.com",
+        },
+        "orderItems": [
+            {
+                "orderItemId": str(6000000000 + i * 10 + j),
+                "cancellationRequest": False,
+                "fulfilment": {
+                    "method": "FBR",
+                    "distributionParty": "RETAILER",
+                    "latestDeliveryDate": "2019-04-30",
+                },
+                "offer": {"offerId": "8f6183e4", "reference": "REF12345"},
+                "product": {"ean": "8785056370398", "title": "Star Wars"},
+                "quantity": 3,
+                "quantityShipped": 0,
+                "quantityCancelled": 0,
+                "unitPrice": 13.12 + j,
+                "commission": 5.12,
+            }
+            for j in range(3)
+        ],
+    }
+
+
+def offer(i):
+    return {
+        "offerId": "offer-{}".format(i),
+        "ean": "8785056370398",
+        "reference": "REF{}".format(i),
+        "onHoldByRetailer": False,
+        "pricing": {
+            "bundlePrices": [
+                {"quantity": 1, "unitPrice": 9.99 + i % 100},
+                {"quantity": 6, "unitPrice": 8.49 + i % 100},
+            ]
+        },
+        "stock": {"amount": i % 50, "correctedStock": i % 50,
+                  "managedByRetailer": False},
+        "fulfilment": {"method": "FBR", "deliveryCode": "24uurs-23"},
+    }
+
+
+def parse_orders(api, content):
+    return Orders.parse(api, content)
+
+
+def parse_offers(api, content):
+    return [OffersResponse.parse(api, item)
+            for item in api.decoder.decode(content)]
+
+
+PAYLOADS = [
+    ("orders (1000)", parse_orders,
+     json.dumps({"orders": [order(i) for i in range(1000)]})),
+    ("offers (5000)", parse_offers,
+     json.dumps([offer(i) for i in range(5000)])),
+]
+
+
+class TextDecimalDecoder(object):
+
+    def decode(self, content):
+        return parse_json(content.decode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    decoders = [("text+Decimal", TextDecimalDecoder()),
+                ("json+Decimal", JSONDecoder()),
+                ("json+float", JSONDecoder(parse_float=float))]
+    if orjson is not None:
+        decoders.append(("orjson", OrjsonDecoder()))
+
+    for name, parse, text in PAYLOADS:
+        content = text.encode("utf-8")
+        print("{}: {:.0f} kB".format(name, len(content) / 1024.0))
+        for decoder_name, decoder in decoders:
+            api = RetailerAPI(decoder=decoder, keep_raw=False)
+            decode = min(timeit.repeat(
+                lambda: decoder.decode(content),
+                number=1, repeat=args.repeat))
+            total = min(timeit.repeat(
+                lambda: parse(api, content),
+                number=1, repeat=args.repeat))
+            print("  {:<14} decode {:7.2f} ms   decode+parse {:7.2f} ms"
+                  .format(decoder_name, decode * 1000, total * 1000))
+
+
+if __name__ == "__main__":
+    main()
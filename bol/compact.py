@@ -0,0 +1,154 @@
+"""
+Support for the compact representation of the Plaza and retailer models.
+
+Model classes are ordinary classes: by default the models are parsed into
+instances of the declared class, with a `__dict__`.
+
+In compact mode they are parsed into "compact" variants instead: generated
+subclasses of the declared class (so `isinstance` checks keep working), one
+per set of attribute names ("shape") seen while parsing, with `__slots__`
+for exactly those names. All attributes are stored in the slots, so the
+`__dict__` inherited from the declared class is never created.
+"""
+import keyword
+import threading
+
+__all__ = ["CompactMixin", "ModelType", "parse_options"]
+
+# Objects of one model class rarely come in more shapes than this; past it,
+# new shapes fall back to the declared class.
+MAX_SHAPES = 64
+
+_lock = threading.Lock()
+
+
+def parse_options(api):
+    """
+    Returns the `(compact, keep_raw)` parse options of an API client. The
+    raw payload is kept unless compact mode is on, or explicitly asked for.
+    """
+    compact = getattr(api, "compact", False)
+    keep_raw = getattr(api, "keep_raw", None)
+    if keep_raw is None:
+        keep_raw = not compact
+    return compact, keep_raw
+
+
+def _slot_name(key, taken):
+    if key.isidentifier() and not keyword.iskeyword(key):
+        return key
+    name = "".join(c if c.isalnum() else "_" for c in key)
+    if not name or name[0].isdigit() or keyword.iskeyword(name):
+        name = "_" + name
+    while name in taken:
+        name += "_"
+    return name
+
+
+def _restore(model, values, items):
+    m = model()
+    m.__dict__.update(values)
+    if items:
+        m.extend(items)
+    return m
+
+
+class ModelType(type):
+
+    def model_class(cls):
+        """
+        The declared model class of a (generated) class.
+        """
+        return cls.__dict__.get("_model", cls)
+
+    def compact_class(cls, keys):
+        """
+        The compact variant for objects with attributes `keys`. Attribute
+        names that are not valid identifiers (e.g. "NCK-Stock") are stored
+        under a mangled slot name and remain readable with `getattr`.
+        """
+        model = cls.model_class()
+        shape = tuple(keys)
+        shapes = model.__dict__.get("_shapes")
+        variant = shapes.get(shape) if shapes is not None else None
+        if variant is not None:
+            return variant
+        with _lock:
+            shapes = model.__dict__.get("_shapes")
+            if shapes is None:
+                shapes = {}
+                type.__setattr__(model, "_shapes", shapes)
+            variant = shapes.get(shape)
+            if variant is None:
+                if len(shapes) >= MAX_SHAPES:
+                    return model
+                slots = {}
+                for key in shape:
+                    slots[key] = _slot_name(key, slots.values())
+                aliases = dict(
+                    (key, slot) for key, slot in slots.items() if key != slot)
+                variant = type(model)(model.__name__, (model,), {
+                    "__slots__": tuple(slots.values()),
+                    "__module__": model.__module__,
+                    "__qualname__": model.__qualname__,
+                    "_model": model,
+                    "_shape": slots,
+                    "_aliases": aliases,
+                })
+                shapes[shape] = variant
+        return variant
+
+
+class CompactMixin(object):
+    """
+    Behaviour shared by all model instances, dict-backed or compact.
+    """
+
+    __slots__ = ()
+
+    # Set on the compact variants only
+    _shape = None
+    _aliases = None
+
+    def __getattr__(self, name):
+        aliases = getattr(type(self), "_aliases", None)
+        if aliases and name in aliases:
+            return getattr(self, aliases[name])
+        raise AttributeError(
+            "'{}' object has no attribute '{}'".format(
+                type(self).__name__, name))
+
+    @property
+    def compact(self):
+        return type(self).__dict__.get("_shape") is not None
+
+    def _set_values(self, values):
+        """
+        Sets attributes from a dict of (unmangled) names to values.
+        """
+        slots = type(self)._shape
+        if slots is None:
+            self.__dict__.update(values)
+            return
+        for key, value in values.items():
+            object.__setattr__(self, slots[key], value)
+
+    def _values(self):
+        """
+        The attributes of the instance as a dict.
+        """
+        slots = type(self)._shape
+        if slots is None:
+            return dict(self.__dict__)
+        values = {}
+        for key, slot in slots.items():
+            try:
+                values[key] = object.__getattribute__(self, slot)
+            except AttributeError:
+                pass
+        return values
+
+    def __reduce_ex__(self, protocol):
+        items = list(self) if isinstance(self, list) else None
+        return (
+            _restore, (type(self).model_class(), self._values(), items))
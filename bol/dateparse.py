@@ -0,0 +1,53 @@
+"""
+Fast parsing of the timestamps returned by the Plaza and retailer APIs.
+
+Both APIs use ISO 8601 (e.g. '2019-04-29T16:18:21+02:00'), which is
+parsed with a precompiled regular expression; anything else is left to
+`dateutil.parser`. Results are memoized, as the same timestamps tend to
+come back many times (all items of an order, all pages of a sync).
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import dateutil.parser
+from dateutil.tz import tzoffset, tzutc
+
+__all__ = ["parse_datetime"]
+
+# The time is optional: at least the Plaza test API returns values like
+# '2016-09-19+02:00', with only the timezone offset after the date. These
+# are taken to be at midnight.
+_ISO_8601 = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d{1,6}))?)?)?"
+    r"(?:(Z)|([+-])(\d{2})(?::?(\d{2}))?)?$"
+)
+
+_UTC = tzutc()
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(text):
+    match = _ISO_8601.match(text)
+    if match is None:
+        return dateutil.parser.parse(text)
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+    tzinfo = None
+    if zulu:
+        tzinfo = _UTC
+    elif sign:
+        offset = int(offset_hours) * 3600 + int(offset_minutes or 0) * 60
+        if sign == "-":
+            offset = -offset
+        tzinfo = tzoffset(None, offset) if offset else _UTC
+    try:
+        return datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int(fraction.ljust(6, "0")) if fraction else 0,
+            tzinfo=tzinfo,
+        )
+    except ValueError:
+        return dateutil.parser.parse(text)
@@ -1,11 +1,6 @@
-import time
+import io
 import requests
-import hmac
-import hashlib
-import base64
-from datetime import datetime
 from datetime import date
-import collections
 from enum import Enum
 
 import traceback
@@ -14,18 +9,22 @@ import traceback
 from xml.etree import ElementTree
 
 from .models import (
-    Orders, Shipments, ProcessStatus, Invoices, Invoice,
-    InvoiceSpecifications)
+    Order, Orders, Shipments, ProcessStatus, Invoices, Invoice,
+    InvoiceSpecification, InvoiceSpecifications)
 
 # custom Method Models For DreamBits
 from .models import PurchasableShippingLabels, ReturnItems
 from .models import OffersResponse, OfferFile  # DeleteBulkRequest
 
 # for get Inventory method
-from .models import InventoryResponse
+from .models import InventoryOffer, InventoryResponse
 
 # for Get All Bounds method
-from .models import GetAllInbounds
+from .models import GetAllInbound, GetAllInbounds
+
+from .signing import Signer
+from .streaming import CHUNK_SIZE, iter_items
+from .xmlwriter import build_request_xml, write_elements
 
 # for Get Single Bounds method
 from .models import GetSingleInbound
@@ -95,15 +94,28 @@ class MethodGroup(object):
         self.group = group
 
     def request(self, method, path='', params={}, data=None,
-                accept="application/xml"):
+                accept="application/xml", stream=False):
         uri = '/services/rest/{group}/{version}{path}'.format(
             group=self.group,
             version=self.api.version,
             path=path)
         xml = self.api.request(method, uri, params=params, data=data,
-                               accept=accept)
+                               accept=accept, stream=stream)
         return xml
 
+    def iter_response(self, response, model, tag=None, depth=1):
+        """
+        Yields the items of a streamed response one at a time, see
+        `bol.plaza.streaming.iter_items`.
+        """
+        try:
+            for item in iter_items(
+                    self.api, response.iter_content(CHUNK_SIZE), model,
+                    tag=tag, depth=depth):
+                yield item
+        finally:
+            response.close()
+
     def request_inbound(self, method, path='', params={}, data=None,
                         accept="application/xml"):
         uri = '/services/rest/{group}/{path}'.format(
@@ -114,132 +126,32 @@ class MethodGroup(object):
         return xml
 
     def create_request_xml(self, root, **kwargs):
-        elements = self._create_request_xml_elements(1, **kwargs)
-        xml = """<?xml version="1.0" encoding="UTF-8"?>
-<{root} xmlns="https://plazaapi.bol.com/services/xsd/v2/plazaapi.xsd">
-{elements}
-</{root}>
-""".format(root=root, elements=elements)
-        return xml
+        return build_request_xml(
+            root, 'https://plazaapi.bol.com/services/xsd/v2/plazaapi.xsd',
+            kwargs)
 
     def create_request_offers_xml(self, root, **kwargs):
-        elements = self._create_request_xml_elements(1, **kwargs)
-        xml = """<?xml version="1.0" encoding="UTF-8"?>
-<{root} xmlns="https://plazaapi.bol.com/offers/xsd/api-2.0.xsd">
-{elements}
-</{root}>
-""".format(root=root, elements=elements)
-        return xml
+        return build_request_xml(
+            root, 'https://plazaapi.bol.com/offers/xsd/api-2.0.xsd', kwargs)
 
     def create_request_inbound_xml(self, root, **kwargs):
-        elements = self.create_request_xml_elements_for_create_inbound(
-            1, **kwargs)
-        xml = """<?xml version="1.0" encoding="UTF-8"?>
-<{root} xmlns="https://plazaapi.bol.com/services/xsd/v1/plazaapi.xsd">
-{elements}
-</{root}>
-""".format(root=root, elements=elements)
-        return xml
+        return build_request_xml(
+            root, 'https://plazaapi.bol.com/services/xsd/v1/plazaapi.xsd',
+            kwargs, join_lists=True)
 
     def create_request_xml_elements_for_create_inbound(self, indent, **kwargs):
         '''
-        this function was copied from #_create_request_ixml_elements
-        to maintain proper structure for specially #create_request_inbound_xml
+        Same as #_create_request_xml_elements, but puts all items of a
+        list in a single element, as #create_request_inbound_xml needs.
         '''
-        # sort to make output deterministic
-        kwargs = collections.OrderedDict(sorted(kwargs.items()))
-        xml = ''
-        for tag, value in list(kwargs.items()):
-            if value is not None:
-                prefix = ' ' * 4 * indent
-                if not isinstance(value, list):
-                    if isinstance(value, dict):
-                        text = '\n{}\n{}'.format(
-                            self._create_request_xml_elements(
-                                indent + 1, **value),
-                            prefix)
-                    elif isinstance(value, datetime):
-                        text = value.isoformat()
-                    else:
-                        text = str(value)
-                    # TODO: Escape! For now this will do I am only dealing
-                    # with track & trace codes and simplistic IDs...
-                    if xml:
-                        xml += '\n'
-                    xml += prefix
-                    xml += "<{tag}>{text}</{tag}>".format(
-                        tag=tag,
-                        text=text
-                    )
-                else:
-                    text = ''
-                    for item in value:
-                        if isinstance(item, dict):
-                            text += '\n{}\n{}'.format(
-                                self._create_request_xml_elements(
-                                    indent + 1, **item),
-                                prefix)
-                        else:
-                            text += str(item)
-                        # TODO: Escape! For now this will do I am only dealing
-                        # with track & trace codes and simplistic IDs...
-                    if xml:
-                        xml += '\n'
-                    xml += prefix
-                    xml += "<{tag}>{text}</{tag}>".format(
-                        tag=tag,
-                        text=text
-                    )
-        return xml
+        buffer = io.StringIO()
+        write_elements(buffer.write, indent, kwargs, join_lists=True)
+        return buffer.getvalue()
 
     def _create_request_xml_elements(self, indent, **kwargs):
-        '''
-        The original one, ... change it at your own risk ...  :)
-        '''
-        # sort to make output deterministic
-        kwargs = collections.OrderedDict(sorted(kwargs.items()))
-        xml = ''
-        for tag, value in list(kwargs.items()):
-            if value is not None:
-                prefix = ' ' * 4 * indent
-                if not isinstance(value, list):
-                    if isinstance(value, dict):
-                        text = '\n{}\n{}'.format(
-                            self._create_request_xml_elements(
-                                indent + 1, **value),
-                            prefix)
-                    elif isinstance(value, datetime):
-                        text = value.isoformat()
-                    else:
-                        text = str(value)
-                    # TODO: Escape! For now this will do I am only dealing
-                    # with track & trace codes and simplistic IDs...
-                    if xml:
-                        xml += '\n'
-                    xml += prefix
-                    xml += "<{tag}>{text}</{tag}>".format(
-                        tag=tag,
-                        text=text
-                    )
-                else:
-                    for item in value:
-                        if isinstance(item, dict):
-                            text = '\n{}\n{}'.format(
-                                self._create_request_xml_elements(
-                                    indent + 1, **item),
-                                prefix)
-                        else:
-                            text = str(item)
-                        # TODO: Escape! For now this will do I am only dealing
-                        # with track & trace codes and simplistic IDs...
-                        if xml:
-                            xml += '\n'
-                        xml += prefix
-                        xml += "<{tag}>{text}</{tag}>".format(
-                            tag=tag,
-                            text=text
-                        )
-        return xml
+        buffer = io.StringIO()
+        write_elements(buffer.write, indent, kwargs)
+        return buffer.getvalue()
 
 
 class OrderMethods(MethodGroup):
@@ -261,6 +173,21 @@ class OrderMethods(MethodGroup):
                            accept="application/vnd.orders-v2.1+xml")
         return Orders.parse(self.api, xml)
 
+    def iter_list(self, page=None, fulfilment_method=None):
+        """
+        Same as `list`, but parses the response while it downloads and
+        yields the `Order`s one at a time.
+        """
+        params = {}
+        if page:
+            params['page'] = page
+        if fulfilment_method:
+            params['fulfilment-method'] = fulfilment_method
+        response = self.request('GET', params=params,
+                                accept="application/vnd.orders-v2.1+xml",
+                                stream=True)
+        return self.iter_response(response, Order, tag='Order')
+
 
 class InvoiceMethods(MethodGroup):
 
@@ -298,6 +225,19 @@ class InvoiceMethods(MethodGroup):
             params=params)
         return InvoiceSpecifications.parse(self.api, xml)
 
+    def iter_specification(self, invoice_id, page=None):
+        """
+        Same as `get_specification`, but parses the response while it
+        downloads and yields the `InvoiceSpecification`s one at a time.
+        """
+        params = {}
+        if page is not None:
+            params['page'] = page
+        uri = '/services/rest/{group}/{id}/specification'.format(
+            group=self.group, id=invoice_id)
+        response = self.api.request('GET', uri, params=params, stream=True)
+        return self.iter_response(response, InvoiceSpecification)
+
 
 class ProcessStatusMethods(MethodGroup):
 
@@ -533,6 +473,19 @@ class InboundMethods(MethodGroup):
 
         return GetAllInbounds.parse(self.api, all_inbound)
 
+    def iter_all_inbounds(self, page=None):
+        """
+        Same as `getAllInbounds`, but parses the response while it
+        downloads and yields the `GetAllInbound`s one at a time.
+        """
+        params = {}
+        if page:
+            params['page'] = page
+        uri = '/services/rest/{group}'.format(group=self.group)
+        response = self.api.request('GET', uri, params=params, stream=True)
+        return self.iter_response(
+            response, GetAllInbound, tag='Inbound', depth=None)
+
     def getSingleInbound(self, inbound_id=None):
 
         if not isinstance(inbound_id, int):
@@ -676,18 +629,47 @@ class InventoryMethods(MethodGroup):
         response = self.api.request('GET', uri, params=params, data=None)
         return InventoryResponse.parse(self.api, response)
 
+    def iter_inventory(self, page=None, quantity=None, stock=None,
+                       state=None, query=None):
+        """
+        Same as `getInventory`, but parses the response while it downloads
+        and yields the `InventoryOffer`s one at a time.
+        """
+        params = {}
+        if page:
+            if not isinstance(page, int):
+                type_exception('int', page)
+            params['page'] = page
+        if quantity:
+            params['quantity'] = quantity
+        if stock:
+            params['stock'] = stock
+        if state:
+            params['state'] = state
+        if query:
+            params['query'] = query
+        uri = '/services/rest/{group}'.format(group=self.group)
+        response = self.api.request('GET', uri, params=params, stream=True)
+        return self.iter_response(response, InventoryOffer, tag='Offer',
+                                  depth=2)
+
 
 class PlazaAPI(object):
 
     def __init__(self, public_key, private_key, test=False, timeout=None,
-                 session=None):
+                 session=None, retry_policy=None, compact=False,
+                 keep_raw=None):
 
         self.public_key = public_key
         self.private_key = private_key
+        self.signer = Signer(public_key, private_key)
         self.url = 'https://%splazaapi.bol.com' % ('test-' if test else '')
 
         self.version = 'v2'
         self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.compact = compact
+        self.keep_raw = keep_raw
         self.orders = OrderMethods(self)
         self.invoices = InvoiceMethods(self)
         self.shipments = ShipmentMethods(self)
@@ -701,41 +683,43 @@ class PlazaAPI(object):
         self.inventory = InventoryMethods(self)
 
     def request(self, method, uri, params={},
-                data=None, accept="application/xml"):
+                data=None, accept="application/xml", retry=None,
+                stream=False):
         try:
             content_type = 'application/xml; charset=UTF-8'
-            date = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
-            msg = """{method}
-
-{content_type}
-{date}
-x-bol-date:{date}
-{uri}""".format(content_type=content_type,
-                date=date,
-                method=method,
-                uri=uri)
-            h = hmac.new(
-                self.private_key.encode('utf-8'),
-                msg.encode('utf-8'), hashlib.sha256)
-            b64 = base64.b64encode(h.digest())
-
-            signature = self.public_key.encode('utf-8') + b':' + b64
-
-            headers = {'Content-Type': content_type,
-                       'X-BOL-Date': date,
-                       'X-BOL-Authorization': signature,
-                       'accept': accept}
-            request_kwargs = {
-                'method': method,
-                'url': self.url + uri,
-                'params': params,
-                'headers': headers,
-                'timeout': self.timeout,
-            }
-            if data:
-                request_kwargs['data'] = data
 
-            resp = self.session.request(**request_kwargs)
+            def send():
+                # Signed per attempt, as the signature covers the date
+                date, signature = self.signer.sign(method, uri, content_type)
+
+                headers = {'Content-Type': content_type,
+                           'X-BOL-Date': date,
+                           'X-BOL-Authorization': signature,
+                           'accept': accept}
+                request_kwargs = {
+                    'method': method,
+                    'url': self.url + uri,
+                    'params': params,
+                    'headers': headers,
+                    'timeout': self.timeout,
+                }
+                if data:
+                    request_kwargs['data'] = data
+                if stream:
+                    request_kwargs['stream'] = True
+                return self.session.request(**request_kwargs)
+
+            if self.retry_policy is None:
+                resp = send()
+            else:
+                resp = self.retry_policy.call(send, method=method,
+                                              retry=retry)
+            url = self.url + uri
+
+            if stream:
+                # The caller parses the body while it downloads
+                resp.raise_for_status()
+                return resp
 
             resp_content = resp.content
             resp_text = resp.text
@@ -745,15 +729,14 @@ x-bol-date:{date}
             if isinstance(resp_text, bytes):
                 resp_text = resp_text.decode(encoding='utf-8')
 
-            if request_kwargs['url'] == 'https://plazaapi.bol.com/offers/v2/':
+            if url == 'https://plazaapi.bol.com/offers/v2/':
                 if resp.status_code == 202 and resp_text is not None:
                     return True
                 else:
                     tree = ElementTree.fromstring(resp_content)
                     return tree
 
-            if 'https://plazaapi.bol.com/offers/v2/export/' in request_kwargs[
-                    'url']:
+            if 'https://plazaapi.bol.com/offers/v2/export/' in url:
                 if accept == "text/csv":
                     return resp_text
 
@@ -765,5 +748,7 @@ x-bol-date:{date}
                 tree = ElementTree.fromstring(resp_content)
                 return tree
         except Exception:
+            if stream:
+                raise
             print("Got into Exception \n{0}".format(traceback.print_exc()))
             return False
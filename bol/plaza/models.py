@@ -1,5 +1,7 @@
 from decimal import Decimal
-import dateutil.parser
+
+from ..compact import CompactMixin, ModelType, parse_options
+from ..dateparse import parse_datetime
 
 
 class Field(object):
@@ -29,15 +31,9 @@ class DecimalField(Field):
 class DateTimeField(Field):
 
     def parse(self, api, xml, instance):
-        # WORKAROUND: At least on the test API I am bumping into this kind of
-        # data: '2016-09-19+02:00'. Here, the time seems missing, only the
-        # timezone offset is present. Let's detect this and handle gracefully.
-        # Contacted BOL, awaiting reply...
-        text = xml.text
-        if text[10] == '+':
-            text = text[:10] + 'T00:00:00' + text[10:]
-        # (end WORKAROUND)
-        return dateutil.parser.parse(text)
+        # Also handles the '2016-09-19+02:00' values (time missing, only
+        # the timezone offset present) seen on the test API.
+        return parse_datetime(xml.text)
 
 
 class IntegerField(Field):
@@ -55,21 +51,73 @@ class ModelField(Field):
         return self.model.parse(api, xml)
 
 
-class Model(object):
+def _local_tag(tag):
+    if '}' in tag:
+        return tag.partition('}')[2]
+    elif ':' in tag:
+        return tag.partition(':')[2]
+    return tag
+
+
+TEXT_FIELD = TextField()
+
+
+class Model(CompactMixin, metaclass=ModelType):
+
+    @classmethod
+    def create(cls, api, xml, names=()):
+        """
+        Creates the instance to parse `xml` into. In compact mode
+        (`PlazaAPI(compact=True)`) it has slots for `names` (and for the
+        element itself, if kept) instead of a `__dict__`.
+        """
+        compact, keep_raw = parse_options(api)
+        if keep_raw:
+            names = ('xml',) + tuple(names)
+        m = cls.compact_class(names)() if compact else cls()
+        if keep_raw:
+            m.xml = xml
+        return m
+
+    @classmethod
+    def tag_table(cls):
+        """
+        Maps qualified element tags ('{namespace}local') to their local
+        name and the `Field` to parse them with. Filled in once per class
+        and tag, as tags are encountered.
+        """
+        model = cls.model_class()
+        table = model.__dict__.get('_tag_table')
+        if table is None:
+            table = {}
+            type.__setattr__(model, '_tag_table', table)
+        return table
+
+    @classmethod
+    def resolve_tag(cls, tag):
+        table = cls.tag_table()
+        entry = table.get(tag)
+        if entry is None:
+            local = _local_tag(tag)
+            entry = (local, getattr(cls.Meta, local, TEXT_FIELD))
+            table[tag] = entry
+        return entry
 
     @classmethod
     def parse(cls, api, xml):
-        m = cls()
-        m.xml = xml
-        for element in xml.getchildren():
-            if '}' in element.tag:
-                tag = element.tag.partition('}')[2]
-            elif ':' in element.tag:
-                tag = element.tag.partition(':')[2]
-            else:
-                tag = element.tag
-            field = getattr(m.Meta, tag, TextField())
-            setattr(m, tag, field.parse(api, element, m))
+        table = cls.tag_table()
+        elements = []
+        for element in xml:
+            entry = table.get(element.tag) or cls.resolve_tag(element.tag)
+            elements.append((entry, element))
+        names = ()
+        if getattr(api, 'compact', False):
+            names = tuple(dict.fromkeys(tag for (tag, _), _ in elements))
+        m = cls.create(api, xml, names)
+        values = {}
+        for (tag, field), element in elements:
+            values[tag] = field.parse(api, element, m)
+        m._set_values(values)
         return m
 
 
@@ -77,10 +125,9 @@ class ModelList(list, Model):
 
     @classmethod
     def parse(cls, api, xml):
-        ml = cls()
-        ml.xml = xml
+        ml = cls.create(api, xml)
         item_tag = getattr(ml.Meta, 'item_type_tag', None)
-        for element in xml.getchildren():
+        for element in xml:
             if item_tag and item_tag != element.tag:
                 continue
             ml.append(ml.Meta.item_type.parse(api, element))
@@ -0,0 +1,75 @@
+"""
+HMAC request signing for the Plaza API.
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+
+__all__ = ["Signer"]
+
+MESSAGE = """{method}
+
+{content_type}
+{date}
+x-bol-date:{date}
+{uri}"""
+
+
+class Signer(object):
+    """
+    Signs Plaza requests with a private key. The HMAC is keyed once and
+    copied per signature. As the signed date has a resolution of one
+    second, the date and the signatures made within the current second
+    are cached, so repeated requests to the same URI sign only once::
+
+        date, signature = signer.sign('GET', '/services/rest/orders/v2')
+
+    Safe to use from several threads.
+    """
+
+    def __init__(self, public_key, private_key,
+                 content_type='application/xml; charset=UTF-8',
+                 clock=time.time):
+        self.public_key = public_key.encode('utf-8')
+        self.content_type = content_type
+        self.clock = clock
+        self.hmac = hmac.new(private_key.encode('utf-8'),
+                             digestmod=hashlib.sha256)
+        self.lock = threading.Lock()
+        self.second = None
+        self.date = None
+        self.signatures = {}
+
+    def current_date(self):
+        """
+        Returns the `X-BOL-Date` value for now and the signature cache of
+        that second.
+        """
+        second = int(self.clock())
+        with self.lock:
+            if second != self.second:
+                self.second = second
+                self.date = time.strftime('%a, %d %b %Y %H:%M:%S GMT',
+                                          time.gmtime(second))
+                self.signatures = {}
+            return self.date, self.signatures
+
+    def sign(self, method, uri, content_type=None):
+        """
+        Returns the `X-BOL-Date` and `X-BOL-Authorization` header values
+        for a request.
+        """
+        if content_type is None:
+            content_type = self.content_type
+        date, signatures = self.current_date()
+        key = (method, content_type, uri)
+        signature = signatures.get(key)
+        if signature is None:
+            h = self.hmac.copy()
+            h.update(MESSAGE.format(method=method, content_type=content_type,
+                                    date=date, uri=uri).encode('utf-8'))
+            signature = self.public_key + b':' + base64.b64encode(h.digest())
+            signatures[key] = signature
+        return date, signature
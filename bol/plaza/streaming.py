@@ -0,0 +1,50 @@
+"""
+Incremental parsing of large Plaza responses.
+
+The response is fed to an `XMLPullParser` chunk by chunk, and every item
+element is parsed into its model as soon as it is complete, then detached
+from the tree, so memory use does not grow with the size of the response.
+"""
+from xml.etree import ElementTree
+
+from ..compact import parse_options
+
+__all__ = ["iter_items"]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _local_tag(tag):
+    return tag.rpartition('}')[2].rpartition(':')[2]
+
+
+def iter_items(api, chunks, model, tag=None, depth=1):
+    """
+    Yields `model` instances parsed from the elements in the XML document
+    `chunks` (an iterable of bytes) with local name `tag` (any when `None`)
+    at `depth` (the root being at depth 0; any when `None`).
+
+    Items only keep their `xml` element when the API keeps the raw
+    payload; otherwise the element is cleared once parsed.
+    """
+    keep_raw = parse_options(api)[1]
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    stack = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                stack.append(element)
+                continue
+            stack.pop()
+            if depth is not None and len(stack) != depth:
+                continue
+            if tag is not None and _local_tag(element.tag) != tag:
+                continue
+            item = model.parse(api, element)
+            if stack:
+                stack[-1].remove(element)
+            if not keep_raw:
+                element.clear()
+            yield item
+    parser.close()
@@ -0,0 +1,71 @@
+"""
+Serialization of Plaza request bodies.
+
+Values are given as (nested) dicts: keys become element tags, sorted so
+that the output is deterministic, and `None` values are left out. A list
+value repeats the element for every item, or, with `join_lists`, puts all
+items in a single element. Text is escaped; datetimes are written in ISO
+8601.
+"""
+import io
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+__all__ = ["write_elements", "build_request_xml"]
+
+INDENT = ' ' * 4
+
+
+def _write_value(write, indent, value):
+    if isinstance(value, dict):
+        write('\n')
+        write_elements(write, indent + 1, value)
+        write('\n')
+        write(INDENT * indent)
+    elif isinstance(value, datetime):
+        write(value.isoformat())
+    else:
+        write(escape(str(value)))
+
+
+def write_elements(write, indent, values, join_lists=False):
+    """
+    Writes the elements for `values` to the `write` callable, one per
+    line, indented by `indent` levels.
+    """
+    prefix = INDENT * indent
+    separator = ''
+    for tag in sorted(values):
+        value = values[tag]
+        if value is None:
+            continue
+        if not isinstance(value, list):
+            items = (value,)
+        elif join_lists:
+            items = (value,)
+        else:
+            items = value
+        for item in items:
+            write(separator)
+            write(prefix)
+            write('<' + tag + '>')
+            if isinstance(item, list):
+                for part in item:
+                    _write_value(write, indent, part)
+            else:
+                _write_value(write, indent, item)
+            write('</' + tag + '>')
+            separator = '\n'
+
+
+def build_request_xml(root, namespace, values, join_lists=False):
+    """
+    Returns the UTF-8 encoded request document with root element `root`.
+    """
+    buffer = io.StringIO()
+    write = buffer.write
+    write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    write('<{} xmlns="{}">\n'.format(root, namespace))
+    write_elements(write, 1, values, join_lists=join_lists)
+    write('\n</{}>\n'.format(root))
+    return buffer.getvalue().encode('utf-8')
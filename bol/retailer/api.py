@@ -1,3 +1,8 @@
+import copy
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 from .models import (
@@ -16,9 +21,27 @@ from .models import (
     SingleReturnItem,
 )
 
-from .constants import TransporterCode
+from .auth import TokenManager
+from .constants import CancellationReasonCode, TransporterCode
+from .decoders import default_decoder
+from .bulk import (
+    BulkCanceller,
+    BulkOfferUpdater,
+    BulkShipper,
+    ProcessStatusTimeout,
+    iter_many,
+)
+from .export import CHUNK_SIZE, OfferExport, iter_offer_export
+
+__all__ = ["RetailerAPI", "ProcessStatusTimeout"]
 
-__all__ = ["RetailerAPI"]
+
+def _process_status_id(process_status):
+    # v5 names the id "processStatusId", older versions "id"
+    process_id = getattr(process_status, "processStatusId", None)
+    if process_id is None:
+        process_id = process_status.id
+    return process_id
 
 
 class MethodGroup(object):
@@ -35,7 +58,58 @@ class MethodGroup(object):
                 group=self.group,
                 path=("/{}".format(path) if path else ""),
             )
-        return self.api.request(method, uri, params=params, **kwargs)
+        return self.api.request(
+            method, uri, params=params, group=self.group, **kwargs)
+
+    def _iter_pages(self, fetch, prefetch=False):
+        """
+        Lazily yields the items of `fetch(page)` for page 1, 2, ... and
+        stops at the first empty page. With `prefetch`, page N+1 is
+        requested in the background while the caller consumes page N.
+        """
+        if not prefetch:
+            page = 1
+            items = fetch(page)
+            while items:
+                for item in items:
+                    yield item
+                page += 1
+                items = fetch(page)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page = 1
+            future = executor.submit(fetch, page)
+            while True:
+                items = future.result()
+                if not items:
+                    break
+                page += 1
+                future = executor.submit(fetch, page)
+                for item in items:
+                    yield item
+        finally:
+            executor.shutdown(wait=False)
+
+    def _get_many(self, get, ids, max_workers=8, max_in_flight=None):
+        """
+        Runs the single-entity `get` for many ids concurrently, sharing the
+        connection pool of `api.session`. Returns a list of `BulkResult` in
+        the order of `ids`; a failing GET is reported on its own result
+        instead of aborting the batch.
+
+        Keep `max_workers` at or below the session's connection pool size
+        (10 by default for `requests`) to reuse connections.
+        """
+        return list(
+            iter_many(
+                get,
+                ids,
+                max_workers=max_workers,
+                max_in_flight=max_in_flight,
+            )
+        )
 
 
 class OrderMethods(MethodGroup):
@@ -49,11 +123,23 @@ class OrderMethods(MethodGroup):
         if page is not None:
             params["page"] = page
         resp = self.request("GET", params=params)
-        return Orders.parse(self.api, resp.text)
+        return Orders.parse(self.api, resp.content)
+
+    def iter_list(self, fulfilment_method=None, prefetch=False):
+        return self._iter_pages(
+            lambda page: self.list(
+                fulfilment_method=fulfilment_method, page=page
+            ),
+            prefetch=prefetch,
+        )
 
     def get(self, order_id):
         resp = self.request("GET", path=order_id)
-        return Order.parse(self.api, resp.text)
+        return Order.parse(self.api, resp.content)
+
+    def get_many(self, order_ids, max_workers=8, max_in_flight=None):
+        return self._get_many(
+            self.get, order_ids, max_workers, max_in_flight)
 
     def ship_order_item(
         self,
@@ -63,13 +149,31 @@ class OrderMethods(MethodGroup):
         transporter_code=None,
         track_and_trace=None,
     ):
-        payload = {}
-        orderItems = [
-            {
-                "orderItems" : order_item_id
-            }
-        ]
-        payload["orderItems"] = orderItems
+        return self.ship_order_items(
+            [order_item_id],
+            shipment_reference=shipment_reference,
+            shipping_label_id=shipping_label_id,
+            transporter_code=transporter_code,
+            track_and_trace=track_and_trace,
+        )
+
+    def ship_order_items(
+        self,
+        order_item_ids,
+        shipment_reference=None,
+        shipping_label_id=None,
+        transporter_code=None,
+        track_and_trace=None,
+    ):
+        """
+        Ships several items of one order in a single shipment.
+        """
+        payload = {
+            "orderItems": [
+                {"orderItemId": order_item_id}
+                for order_item_id in order_item_ids
+            ]
+        }
         if shipment_reference:
             payload["shipmentReference"] = shipment_reference
         if shipping_label_id:
@@ -86,21 +190,53 @@ class OrderMethods(MethodGroup):
         resp = self.request(
             "PUT", path="shipment", json=payload
         )
-        return ProcessStatus.parse(self.api, resp.text)
+        return ProcessStatus.parse(self.api, resp.content)
+
+    def ship_many(self, items, max_workers=8, wait=True, timeout=None,
+                  on_result=None):
+        """
+        Ships many order items with one request per shipment, see
+        `bol.retailer.bulk.BulkShipper`.
+        """
+        shipper = BulkShipper(
+            self.api, max_workers=max_workers, wait=wait, timeout=timeout,
+            on_result=on_result)
+        return shipper.run(items)
 
     def cancel_order_item(self, order_item_id, reason_code):
+        return self.cancel_order_items([(order_item_id, reason_code)])
+
+    def cancel_order_items(self, cancellations):
+        """
+        Cancels several order items, given as `(order_item_id,
+        reason_code)` pairs, in a single request.
+        """
         payload = {
             "orderItems": [
                 {
-                "orderItemId": order_item_id,
-                "reasonCode": reason_code
+                    "orderItemId": order_item_id,
+                    "reasonCode": CancellationReasonCode.to_string(
+                        reason_code),
                 }
+                for order_item_id, reason_code in cancellations
             ]
         }
         resp = self.request(
             "PUT", path="cancellation", json=payload
         )
-        return ProcessStatus.parse(self.api, resp.text)
+        return ProcessStatus.parse(self.api, resp.content)
+
+    def cancel_many(self, cancellations, max_items=50, group_by_order=False,
+                    max_workers=8, wait=True, timeout=None, on_result=None):
+        """
+        Cancels many order items with as few requests as possible, see
+        `bol.retailer.bulk.BulkCanceller`.
+        """
+        canceller = BulkCanceller(
+            self.api, max_items=max_items, group_by_order=group_by_order,
+            max_workers=max_workers, wait=wait, timeout=timeout,
+            on_result=on_result)
+        return canceller.run(cancellations)
 
 
 class ShipmentMethods(MethodGroup):
@@ -110,17 +246,33 @@ class ShipmentMethods(MethodGroup):
     def list(self, fulfilment_method=None, page=None, order_id=None):
         params = {}
         if fulfilment_method:
-            params["fulfilment-method"] = fulfilment_method.value
+            params["fulfilment-method"] = getattr(
+                fulfilment_method, "value", fulfilment_method)
         if page is not None:
             params["page"] = page
         if order_id:
             params["order_id"] = order_id
         resp = self.request("GET", params=params)
-        return Shipments.parse(self.api, resp.text)
+        return Shipments.parse(self.api, resp.content)
+
+    def iter_list(self, fulfilment_method=None, order_id=None,
+                  prefetch=False):
+        return self._iter_pages(
+            lambda page: self.list(
+                fulfilment_method=fulfilment_method,
+                page=page,
+                order_id=order_id,
+            ),
+            prefetch=prefetch,
+        )
 
     def get(self, shipment_id):
         resp = self.request("GET", path=str(shipment_id))
-        return Shipment.parse(self.api, resp.text)
+        return Shipment.parse(self.api, resp.content)
+
+    def get_many(self, shipment_ids, max_workers=8, max_in_flight=None):
+        return self._get_many(
+            self.get, shipment_ids, max_workers, max_in_flight)
 
 
 class ProcessStatusMethods(MethodGroup):
@@ -132,17 +284,96 @@ class ProcessStatusMethods(MethodGroup):
         if page:
             params["page"] = page
         resp = self.request("GET", params=params)
-        return ProcessStatuses.parse(self.api, resp.text)
+        return ProcessStatuses.parse(self.api, resp.content)
+
+    def iter_get(self, entity_id, event_type, prefetch=False):
+        return self._iter_pages(
+            lambda page: self.get(entity_id, event_type, page=page),
+            prefetch=prefetch,
+        )
 
     def getById(self, process_id):
         resp = self.request("GET", path=str(process_id))
-        return ProcessStatus.parse(self.api, resp.text)
+        return ProcessStatus.parse(self.api, resp.content)
+
+    def get_many(self, process_ids, max_workers=8, max_in_flight=None):
+        return self._get_many(
+            self.getById, process_ids, max_workers, max_in_flight)
 
     def getByIds(self, process_ids):
-        if not type(process_ids) is list:
-            return {}
-        resp = self.request("POST", params=process_ids)
-        return ProcessStatus.parse(self.api, resp.text)
+        payload = {
+            "processStatusQueries": [
+                {"processStatusId": process_id}
+                for process_id in process_ids
+            ]
+        }
+        # A status query does not change anything, so it can be retried
+        resp = self.request("POST", json=payload, retry=True)
+        return ProcessStatuses.parse(self.api, resp.content)
+
+    def wait_all(
+        self,
+        process_statuses,
+        timeout=None,
+        min_interval=1,
+        max_interval=30,
+        batch_size=1000,
+    ):
+        """
+        Yields each of the given process statuses (`ProcessStatus`
+        instances or process ids) once it is no longer pending, in order
+        of completion.
+
+        Only the pending ids are polled, `batch_size` of them per bulk
+        request. The poll interval starts at `min_interval`, doubles
+        (up to `max_interval`) while nothing completes, and drops back
+        as soon as something does. `ProcessStatusTimeout` is raised when
+        statuses are still pending after `timeout` seconds.
+        """
+        pending = OrderedDict()
+        for process_status in process_statuses:
+            if isinstance(process_status, ProcessStatus):
+                if process_status.status != "PENDING":
+                    yield process_status
+                    continue
+                process_id = _process_status_id(process_status)
+            else:
+                process_id = process_status
+            pending[str(process_id)] = process_status
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        interval = min_interval
+        while pending:
+            completed = 0
+            process_ids = list(pending)
+            for i in range(0, len(process_ids), batch_size):
+                statuses = self.getByIds(process_ids[i:i + batch_size])
+                for process_status in statuses:
+                    process_id = str(_process_status_id(process_status))
+                    if process_id not in pending:
+                        continue
+                    if process_status.status == "PENDING":
+                        pending[process_id] = process_status
+                    else:
+                        del pending[process_id]
+                        completed += 1
+                        yield process_status
+            if not pending:
+                break
+            if completed:
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+            if deadline is not None and time.monotonic() + interval > deadline:
+                raise ProcessStatusTimeout(list(pending.values()))
+            time.sleep(interval)
+
+    def wait(self, process_status, timeout=None, **kwargs):
+        for process_status in self.wait_all(
+                [process_status], timeout=timeout, **kwargs):
+            return process_status
 
 class InvoiceMethods(MethodGroup):
     def __init__(self, api):
@@ -151,11 +382,15 @@ class InvoiceMethods(MethodGroup):
     def list(self, period_start=None, period_end=None):
         params = {}
         resp = self.request("GET", params=params)
-        return Invoices.parse(self.api, resp.text)
+        return Invoices.parse(self.api, resp.content)
 
     def get(self, invoice_id):
         resp = self.request("GET", path=str(invoice_id))
-        return Invoice.parse(self.api, resp.text)
+        return Invoice.parse(self.api, resp.content)
+
+    def get_many(self, invoice_ids, max_workers=8, max_in_flight=None):
+        return self._get_many(
+            self.get, invoice_ids, max_workers, max_in_flight)
 
     def get_specification(self, invoice_id, page=None):
         params = {}
@@ -164,7 +399,13 @@ class InvoiceMethods(MethodGroup):
         resp = self.request(
             "GET", path="{}/specification".format(invoice_id), params=params
         )
-        return InvoiceSpecification.parse(self.api, resp.text)
+        return InvoiceSpecification.parse(self.api, resp.content)
+
+    def iter_specification(self, invoice_id, prefetch=False):
+        return self._iter_pages(
+            lambda page: self.get_specification(invoice_id, page=page),
+            prefetch=prefetch,
+        )
 
 
 class TransportMethods(MethodGroup):
@@ -199,7 +440,7 @@ class PurchasableShippingLabelsMethods(MethodGroup):
 
     def get(self, order_itemid):
         resp = self.request('GET', path=order_itemid)
-        return PurchasableShippingLabels.parse(self.api, resp.text)
+        return PurchasableShippingLabels.parse(self.api, resp.content)
 
 
 class OffersMethods(MethodGroup):
@@ -219,7 +460,7 @@ class OffersMethods(MethodGroup):
         # Keeping the validation part out of scope for now and just make request
         # And handle response
         response = self.request('POST', json=data)
-        return ProcessStatus.parse(self.api, response.text)
+        return ProcessStatus.parse(self.api, response.content)
 
     def updateProduct(self, offer_id, data):
         if "fulfilment" not in data:
@@ -228,26 +469,50 @@ class OffersMethods(MethodGroup):
             return "{'error': 'Insufficient data provided'}"
 
         response = self.request('PUT', path='{}'.format(offer_id), json=data)
-        return ProcessStatus.parse(self.api, response.text)
-
-    def updateProductPrice(self, offer_id, data):
+        return ProcessStatus.parse(self.api, response.content)
+
+    def updateProductPrice(self, offer_id, data, skip_unchanged=True):
+        cache = self.api.offer_cache
+        if cache is not None:
+            if skip_unchanged and cache.price_unchanged(offer_id, data):
+                return None
+            cache.invalidate(offer_id, "bundlePrices")
         response = self.request('PUT', path='{}/price'.format(offer_id), json=data)
-        return ProcessStatus.parse(self.api, response.text)
-
-    def updateProductStock(self, offer_id, data):
+        return ProcessStatus.parse(self.api, response.content)
+
+    def updateProductStock(self, offer_id, data, skip_unchanged=True):
+        cache = self.api.offer_cache
+        if cache is not None:
+            if skip_unchanged and cache.stock_unchanged(offer_id, data):
+                return None
+            cache.invalidate(offer_id, "amount", "managedByRetailer")
         response = self.request('PUT', path='{}/stock'.format(offer_id), json=data)
-        return ProcessStatus.parse(self.api, response.text)
+        return ProcessStatus.parse(self.api, response.content)
+
+    def bulk_update(self, changes, max_workers=8, wait=True, timeout=None,
+                    on_result=None, managed_by_retailer=None):
+        """
+        Updates the price and/or stock of many offers, see
+        `bol.retailer.bulk.BulkOfferUpdater`.
+        """
+        updater = BulkOfferUpdater(
+            self.api, max_workers=max_workers, wait=wait, timeout=timeout,
+            on_result=on_result, managed_by_retailer=managed_by_retailer)
+        return updater.run(changes)
 
     def getSingleOffer(self, offer_id):
         response = self.request('GET', path=str(offer_id))
-        return OffersResponse.parse(self.api, response.text)
+        offer = OffersResponse.parse(self.api, response.content)
+        if self.api.offer_cache is not None:
+            self.api.offer_cache.update_from_offer(offer)
+        return offer
 
     def requestExportFile(self):
         payload = {
             'format': 'CSV'
         }
         response = self.request('POST', path='export', json=payload)
-        return ProcessStatus.parse(self.api, response.text)
+        return ProcessStatus.parse(self.api, response.content)
 
     def getOffersFile(self, export_id):
         headers = {
@@ -257,9 +522,43 @@ class OffersMethods(MethodGroup):
                                     headers=headers)
         return response
 
+    def iter_offers_file(self, export_id, write_to=None,
+                         chunk_size=CHUNK_SIZE):
+        """
+        Streams the offer export and yields an `OfferExportRow` per offer
+        while it downloads. See `bol.retailer.export.iter_offer_export`
+        for `write_to`.
+        """
+        headers = {
+            "accept": "application/vnd.retailer.v4+csv"
+        }
+        response = self.request('GET', path='export/{}'.format(export_id),
+                                headers=headers, stream=True)
+        try:
+            for row in iter_offer_export(
+                    self.api, response.iter_content(chunk_size),
+                    write_to=write_to):
+                yield row
+        finally:
+            response.close()
+
+    def export_all(self, workdir=None, index_by=None, max_age=1800,
+                   timeout=3600):
+        """
+        Requests an offer export, waits for it and returns its offers: an
+        iterator of `OfferExportRow`, or a dict keyed by the `index_by`
+        column. See `bol.retailer.export.OfferExport` for resuming with a
+        `workdir`.
+        """
+        export = OfferExport(self.api, workdir=workdir, max_age=max_age,
+                             timeout=timeout)
+        if index_by:
+            return export.table(index_by)
+        return export.rows()
+
     def deleteOffers(self, offer_id):
         response = self.request('DELETE', path='{}'.format(offer_id))
-        return ProcessStatus.parse(self.api, response.text)
+        return ProcessStatus.parse(self.api, response.content)
 
 
 class ReturnsMethods(MethodGroup):
@@ -271,16 +570,25 @@ class ReturnsMethods(MethodGroup):
         if page != 1:
             params["page"] = page
         resp = self.request("GET", params=params)
-        return ReturnItems.parse(self.api, resp.text)
+        return ReturnItems.parse(self.api, resp.content)
+
+    def iter_get(self, prefetch=False):
+        return self._iter_pages(
+            lambda page: self.get(page=page), prefetch=prefetch
+        )
 
     def getSingle(self, rmaId):
         resp = self.request("GET", path=str(rmaId))
-        return SingleReturnItem.parse(self.api, resp.text)
+        return SingleReturnItem.parse(self.api, resp.content)
+
+    def get_many(self, rma_ids, max_workers=8, max_in_flight=None):
+        return self._get_many(
+            self.getSingle, rma_ids, max_workers, max_in_flight)
 
     def handleReturnItem(self, rmaId, status_reason, qty):
         payload = {"handlingResult": status_reason, "quantityReturned": qty}
         response = self.request("PUT", path=str(rmaId), json=payload)
-        return ProcessStatus.parse(self.api, response.text)
+        return ProcessStatus.parse(self.api, response.content)
 
 
 class RetailerAPI(object):
@@ -293,12 +601,35 @@ class RetailerAPI(object):
         api_url=None,
         login_url=None,
         refresh_token=None,
+        rate_limiter=None,
+        retry_policy=None,
+        offer_cache=None,
+        compact=False,
+        keep_raw=None,
+        decoder=None,
+        lazy=False,
+        token_manager=None,
+        response_cache=None,
     ):
         self.demo = demo
         self.api_url = api_url or "https://api.bol.com"
         self.login_url = login_url or "https://login.bol.com"
         self.timeout = timeout
         self.refresh_token = refresh_token
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.offer_cache = offer_cache
+        self.compact = compact
+        self.keep_raw = keep_raw
+        self.lazy = lazy
+        self.token_manager = token_manager
+        self.response_cache = response_cache
+        self.decoder = decoder or default_decoder()
+        self._bind_method_groups()
+        self.session = session or requests.Session()
+        self.session.headers.update({"Accept": "application/json"})
+
+    def _bind_method_groups(self):
         self.orders = OrderMethods(self)
         self.shipments = ShipmentMethods(self)
         self.invoices = InvoiceMethods(self)
@@ -306,24 +637,27 @@ class RetailerAPI(object):
         self.offers = OffersMethods(self)
         self.labels = PurchasableShippingLabelsMethods(self)
         self.returns = ReturnsMethods(self)
-        self.session = session or requests.Session()
-        self.session.headers.update({"Accept": "application/json"})
+
+    def with_options(self, **options):
+        """
+        Returns a client with other parse options (`compact`, `keep_raw`,
+        `lazy`), sharing the session, login, rate limiter and caches with
+        this one::
+
+            orders = api.with_options(keep_raw=False).orders.list()
+        """
+        for name in options:
+            if name not in ("compact", "keep_raw", "lazy"):
+                raise TypeError("Unknown option '{}'".format(name))
+        api = copy.copy(self)
+        api.__dict__.update(options)
+        api._bind_method_groups()
+        return api
 
     def login(self, client_id, client_secret):
-        data = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials",
-        }
-        resp = self.session.post(
-            self.login_url + "/token",
-            auth=(client_id, client_secret),
-            data=data,
-        )
-        resp.raise_for_status()
-        token = resp.json()
-        self.set_access_token(token["access_token"])
-        return token
+        if self.token_manager is None:
+            self.token_manager = TokenManager()
+        return self.token_manager.login(self, client_id, client_secret)
 
     def refresh_access_token(
         self,
@@ -338,21 +672,10 @@ class RetailerAPI(object):
         if refresh_token is None and self.refresh_token is not None:
             refresh_token = self.refresh_token
 
-        params = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token
-        }
-
-        resp = self.session.post(
-            self.login_url + "/token",
-            params=params,
-            auth=(username, password),
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        self.refresh_token = data["refresh_token"]
-        self.set_access_token(data["access_token"])
-        return data
+        if self.token_manager is None:
+            self.token_manager = TokenManager()
+        return self.token_manager.login(
+            self, username, password, refresh_token=refresh_token)
 
     def set_access_token(self, access_token):
         self.session.headers.update(
@@ -362,7 +685,8 @@ class RetailerAPI(object):
             }
         )
 
-    def request(self, method, uri, params={}, **kwargs):
+    def request(self, method, uri, params={}, group=None, retry=None,
+                **kwargs):
         request_kwargs = dict(**kwargs)
         request_kwargs.update(
             {
@@ -384,6 +708,50 @@ class RetailerAPI(object):
                 "content-type": content_header
             })
 
-        resp = self.session.request(**request_kwargs)
+        def send(request_kwargs):
+            return self._send_authorized(group, request_kwargs, retry=retry)
+
+        if self.response_cache is not None:
+            resp = self.response_cache.request(
+                self, group, request_kwargs, send)
+        else:
+            resp = send(request_kwargs)
         resp.raise_for_status()
         return resp
+
+    def _send_authorized(self, group, request_kwargs, retry=None):
+        token = None
+        if self.token_manager is not None:
+            token = self.token_manager.ensure(self)
+        resp = self._send(group, request_kwargs, retry=retry)
+        if resp.status_code == 401 and token is not None:
+            # Revoked or expired early: retry once with a new token
+            resp.close()
+            self.token_manager.ensure(self, expired=token)
+            resp = self._send(group, request_kwargs, retry=retry)
+        return resp
+
+    def _send(self, group, request_kwargs, retry=None):
+        if self.retry_policy is None:
+            return self._send_throttled(group, request_kwargs)
+        return self.retry_policy.call(
+            lambda: self._send_throttled(group, request_kwargs),
+            method=request_kwargs["method"],
+            retry=retry,
+        )
+
+    def _send_throttled(self, group, request_kwargs):
+        if self.rate_limiter is None:
+            return self.session.request(**request_kwargs)
+        throttled = 0
+        while True:
+            self.rate_limiter.acquire(group)
+            resp = self.session.request(**request_kwargs)
+            self.rate_limiter.update(group, resp)
+            # A 429 means the request was not processed, so it is safe to
+            # send it again once the bucket allows it, whatever the method.
+            if (resp.status_code != 429 or
+                    throttled >= self.rate_limiter.max_retries):
+                return resp
+            throttled += 1
+            resp.close()
@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import inspect
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from .api import RetailerAPI
+
+__all__ = ["AsyncRetailerAPI"]
+
+
+class AsyncMethodGroup(object):
+    """
+    Exposes the public methods of a (synchronous) retailer method group as
+    coroutines. The results are the very same `bol.retailer.models`
+    objects the synchronous API returns.
+
+    The methods that iterate (`iter_list`, `iter_offers_file`, `wait_all`,
+    ...) are exposed as async generators instead, which fetch each item,
+    and so each page, on the thread pool::
+
+        async for order in api.orders.iter_list():
+            ...
+
+    Other methods returning an iterator, such as `offers.export_all`
+    without `index_by`, return it as an async iterator.
+    """
+
+    def __init__(self, api, methods):
+        self.api = api
+        self.methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self.methods, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        if name.startswith("iter_") or inspect.isgeneratorfunction(attr):
+            @functools.wraps(attr)
+            async def generator(*args, **kwargs):
+                iterator = await self.api.run(attr, *args, **kwargs)
+                async for item in self.api.iterate(iterator):
+                    yield item
+
+            return generator
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            result = await self.api.run(attr, *args, **kwargs)
+            if isinstance(result, Iterator):
+                return self.api.iterate(result)
+            return result
+
+        return method
+
+
+class AsyncRetailerAPI(object):
+    """
+    asyncio front-end for `RetailerAPI`.
+
+    This is not a native asyncio HTTP client: every call runs the
+    synchronous (`requests` based) method on a thread pool of
+    `max_connections` threads, which share a single keep-alive connection
+    pool of `max_connections` connections per host. So at most
+    `max_connections` calls are in flight at a time, the others wait for
+    a free thread, and cancelling a call does not abort the request
+    already running in its thread::
+
+        api = AsyncRetailerAPI(max_connections=20)
+        await api.login('client_id', 'client_secret')
+        orders = await asyncio.gather(
+            *[api.orders.get(order_id) for order_id in order_ids])
+    """
+
+    groups = (
+        "orders",
+        "shipments",
+        "process_status",
+        "invoices",
+        "offers",
+        "labels",
+        "returns",
+    )
+
+    def __init__(self, max_connections=10, api=None, **kwargs):
+        self.sync_api = api or RetailerAPI(**kwargs)
+        self.max_connections = max_connections
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=max_connections,
+            pool_block=True,
+        )
+        self.sync_api.session.mount(self.sync_api.api_url, adapter)
+        self.sync_api.session.mount(self.sync_api.login_url, adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+        for group in self.groups:
+            setattr(
+                self,
+                group,
+                AsyncMethodGroup(self, getattr(self.sync_api, group)),
+            )
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def iterate(self, iterator):
+        """
+        Yields the items of a blocking `iterator`, each fetched on the
+        thread pool.
+        """
+        done = object()
+        try:
+            while True:
+                item = await self.run(next, iterator, done)
+                if item is done:
+                    return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self.run(close)
+
+    async def login(self, client_id, client_secret):
+        return await self.run(self.sync_api.login, client_id, client_secret)
+
+    async def refresh_access_token(
+        self, username, password, refresh_token=None
+    ):
+        return await self.run(
+            self.sync_api.refresh_access_token,
+            username,
+            password,
+            refresh_token=refresh_token,
+        )
+
+    def set_access_token(self, access_token):
+        self.sync_api.set_access_token(access_token)
+
+    async def request(self, method, uri, params={}, **kwargs):
+        return await self.run(
+            self.sync_api.request, method, uri, params=params, **kwargs
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.sync_api.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
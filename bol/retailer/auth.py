@@ -0,0 +1,184 @@
+"""
+Access token management for the retailer API.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ["FileTokenCache", "TokenManager"]
+
+
+class FileTokenCache(object):
+    """
+    Token cache in a JSON file, shared by the processes on one machine so
+    that they log in once per token lifetime between them. Refreshes are
+    serialized with an exclusive lock on `<path>.lock` (where `fcntl` is
+    available). The file holds live credentials and is created readable
+    by its owner only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        with open(self.path + ".lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self, key):
+        try:
+            with open(self.path) as f:
+                return json.load(f).get(key)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, key, record):
+        try:
+            with open(self.path) as f:
+                records = json.load(f)
+        except (IOError, OSError, ValueError):
+            records = {}
+        records[key] = record
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(records, f)
+        os.replace(tmp_path, self.path)
+
+
+class TokenManager(object):
+    """
+    Keeps the access token of a `RetailerAPI` valid. `RetailerAPI.login`
+    creates one unless the API was given its own::
+
+        api = RetailerAPI(token_manager=TokenManager(
+            cache=FileTokenCache('/var/run/bol-token.json')))
+        api.login(client_id, client_secret)
+
+    The token is refreshed `margin` seconds before it expires. A request
+    answered with 401 is retried once with a new token. Threads wanting a
+    new token at the same time share a single refresh; with a `cache`,
+    so do the processes using it.
+
+    `RetailerAPI.refresh_access_token` logs in with a refresh token
+    instead; new tokens are then requested with the refresh token grant,
+    using the latest refresh token handed out.
+    """
+
+    def __init__(self, cache=None, margin=30, clock=time.time):
+        self.cache = cache
+        self.margin = margin
+        self.clock = clock
+        self.client_id = None
+        self.client_secret = None
+        self.refresh_token = None
+        self.record = None
+        self.lock = threading.Lock()
+
+    @property
+    def access_token(self):
+        if self.record is None:
+            return None
+        return self.record["token"]["access_token"]
+
+    def fresh(self, record):
+        if record is None:
+            return False
+        expires_at = record.get("expires_at")
+        return expires_at is None or self.clock() < expires_at - self.margin
+
+    def fetch(self, api):
+        if self.refresh_token is not None:
+            resp = api.session.post(
+                api.login_url + "/token",
+                auth=(self.client_id, self.client_secret),
+                params={
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token,
+                },
+            )
+        else:
+            resp = api.session.post(
+                api.login_url + "/token",
+                auth=(self.client_id, self.client_secret),
+                data={
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "grant_type": "client_credentials",
+                },
+            )
+        resp.raise_for_status()
+        token = resp.json()
+        expires_at = None
+        if token.get("expires_in"):
+            expires_at = self.clock() + token["expires_in"]
+        return {"token": token, "expires_at": expires_at}
+
+    def refresh(self, api, expired=None):
+        """
+        Replaces the current token, unless the cache has a fresh one other
+        than `expired`.
+        """
+        if self.cache is None:
+            self.record = self.fetch(api)
+        else:
+            with self.cache.locked():
+                record = self.cache.load(self.client_id)
+                if (not self.fresh(record) or
+                        record["token"]["access_token"] == expired):
+                    if self.refresh_token is not None and record:
+                        # Another process may have used up ours
+                        self.refresh_token = record["token"].get(
+                            "refresh_token", self.refresh_token)
+                    record = self.fetch(api)
+                    self.cache.save(self.client_id, record)
+                self.record = record
+        if self.refresh_token is not None:
+            self.refresh_token = self.record["token"].get(
+                "refresh_token", self.refresh_token)
+            api.refresh_token = self.refresh_token
+        api.set_access_token(self.access_token)
+
+    def login(self, api, client_id, client_secret, refresh_token=None):
+        """
+        Logs in with the client credentials, or with the refresh token
+        grant when a `refresh_token` is given.
+        """
+        with self.lock:
+            self.client_id = client_id
+            self.client_secret = client_secret
+            self.refresh_token = refresh_token
+            self.refresh(api)
+            return self.record["token"]
+
+    def ensure(self, api, expired=None):
+        """
+        Makes sure that `api` has a token that is not about to expire and
+        is not `expired` (the token a request was just rejected with), and
+        returns it.
+        """
+        if self.client_id is None:
+            return None
+        if expired is None and self.fresh(self.record):
+            return self.access_token
+        with self.lock:
+            if expired is None:
+                stale = not self.fresh(self.record)
+            else:
+                stale = self.access_token == expired
+            if stale:
+                self.refresh(api, expired)
+            return self.access_token
@@ -0,0 +1,495 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import CancellationReasonCode
+
+
+class ProcessStatusTimeout(Exception):
+    """
+    Raised when process statuses are still pending after the timeout. The
+    last known `ProcessStatus` (or the bare id) of each of them is
+    available as `pending`.
+    """
+
+    def __init__(self, pending):
+        self.pending = pending
+        super(ProcessStatusTimeout, self).__init__(
+            "{} process status(es) still pending".format(len(pending)))
+
+
+class BulkResult(object):
+    """
+    Outcome of one call of a bulk operation: either `value` is set, or the
+    exception that was raised is available as `error`.
+    """
+
+    def __init__(self, id, value=None, error=None):
+        self.id = id
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<BulkResult {!r}: {!r}>".format(self.id, self.value)
+        return "<BulkResult {!r} failed: {!r}>".format(self.id, self.error)
+
+
+def _call(func, id):
+    try:
+        return BulkResult(id, value=func(id))
+    except Exception as e:
+        return BulkResult(id, error=e)
+
+
+def iter_many(func, ids, max_workers=8, max_in_flight=None):
+    """
+    Calls `func(id)` for every id on a thread pool and yields a
+    `BulkResult` per id, in input order. At most `max_in_flight` calls are
+    submitted ahead of the result being yielded, so `ids` may be a large
+    (lazy) iterable.
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    max_in_flight = max(max_in_flight, 1)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for id in ids:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_call, func, id))
+        while pending:
+            yield pending.popleft().result()
+
+
+class OfferUpdateResult(object):
+    """
+    Outcome of the price and/or stock update of one offer. For each of
+    "price" and "stock" that was submitted, `process_statuses` holds the
+    (final, when waited for) `ProcessStatus` and `errors` the exception
+    if the submission itself failed. Updates skipped because the offer
+    cache already had the same state are listed in `skipped`.
+    """
+
+    def __init__(self, offer_id, changes):
+        self.offer_id = offer_id
+        self.changes = changes
+        self.process_statuses = {}
+        self.errors = {}
+        self.skipped = set()
+
+    @property
+    def ok(self):
+        return not self.errors and all(
+            process_status.status == "SUCCESS"
+            for process_status in self.process_statuses.values()
+        )
+
+    def __repr__(self):
+        return "<OfferUpdateResult {!r}: {}>".format(
+            self.offer_id,
+            ", ".join(
+                "{}={}".format(kind, self._outcome(kind))
+                for kind in ("price", "stock") if kind in self.changes))
+
+    def _outcome(self, kind):
+        if kind in self.skipped:
+            return "SKIPPED"
+        if kind in self.process_statuses:
+            return self.process_statuses[kind].status
+        return self.errors.get(kind)
+
+
+class BulkOfferUpdater(object):
+    """
+    Submits many price and stock updates concurrently and tracks the
+    resulting process statuses to completion::
+
+        updater = BulkOfferUpdater(api, max_workers=8)
+        report = updater.run([
+            (offer_id, {'price': Decimal('12.99')}),
+            (offer_id, {'stock': 4}),
+            (other_offer_id, {'price': Decimal('5.00'), 'stock': 0}),
+        ])
+
+    Changes to the same offer are collapsed, the last value given for its
+    price or stock wins, so each offer gets at most one price and one
+    stock update. Requests go through the API's rate limiter, if any, and
+    updates matching the API's offer cache are skipped.
+    `run` returns an ordered dict of `OfferUpdateResult` keyed by offer id;
+    `on_result` is called with each result as soon as it is final. Updates
+    still pending after `timeout` seconds are reported with their last
+    (PENDING) process status.
+
+    A stock update also sets whether the stock is managed by the retailer:
+    the `managed_by_retailer` given with the change, else the updater's
+    `managed_by_retailer`, else the value in the API's offer cache. Stock
+    updates for which none of these is known fail with a `ValueError`.
+    """
+
+    def __init__(self, api, max_workers=8, wait=True, timeout=None,
+                 on_result=None, managed_by_retailer=None):
+        self.api = api
+        self.max_workers = max_workers
+        self.wait = wait
+        self.timeout = timeout
+        self.on_result = on_result
+        self.managed_by_retailer = managed_by_retailer
+
+    @staticmethod
+    def collapse(changes):
+        collapsed = OrderedDict()
+        for offer_id, change in changes:
+            collapsed.setdefault(offer_id, {}).update(change)
+        return collapsed
+
+    def resolve_managed_by_retailer(self, offer_id, change):
+        managed = change.get("managed_by_retailer")
+        if managed is None:
+            managed = self.managed_by_retailer
+        if managed is None and self.api.offer_cache is not None:
+            managed = self.api.offer_cache.get(offer_id).get(
+                "managedByRetailer")
+        if managed is None:
+            raise ValueError(
+                "managed_by_retailer is unknown for offer {}".format(
+                    offer_id))
+        return managed
+
+    def submit(self, task):
+        offer_id, kind, change = task
+        offers = self.api.offers
+        if kind == "price":
+            return offers.updateProductPrice(offer_id, {
+                "pricing": {
+                    "bundlePrices": [{
+                        "quantity": 1,
+                        "unitPrice": float(change["price"]),
+                    }]
+                }
+            })
+        return offers.updateProductStock(offer_id, {
+            "amount": int(change["stock"]),
+            "managedByRetailer": change["managed_by_retailer"],
+        })
+
+    def remember(self, offer_id, kind, change):
+        cache = self.api.offer_cache
+        if cache is None:
+            return
+        if kind == "price":
+            cache.update(offer_id, bundle_prices=[
+                {"quantity": 1, "unitPrice": change["price"]}])
+        else:
+            cache.update(
+                offer_id,
+                amount=change["stock"],
+                managed_by_retailer=change["managed_by_retailer"])
+
+    def run(self, changes):
+        results = OrderedDict()
+        remaining = {}
+        tasks = []
+        unresolved = []
+
+        def done(offer_id):
+            remaining[offer_id] -= 1
+            if not remaining[offer_id] and self.on_result is not None:
+                self.on_result(results[offer_id])
+
+        for offer_id, change in self.collapse(changes).items():
+            results[offer_id] = OfferUpdateResult(offer_id, change)
+            remaining[offer_id] = 0
+            for kind in ("price", "stock"):
+                if kind not in change:
+                    continue
+                remaining[offer_id] += 1
+                if kind == "stock":
+                    try:
+                        change["managed_by_retailer"] = \
+                            self.resolve_managed_by_retailer(
+                                offer_id, change)
+                    except ValueError as e:
+                        results[offer_id].errors[kind] = e
+                        unresolved.append(offer_id)
+                        continue
+                tasks.append((offer_id, kind, change))
+        for offer_id in unresolved:
+            done(offer_id)
+
+        by_process_id = {}
+        pending = []
+
+        for bulk_result in iter_many(
+                self.submit, tasks, max_workers=self.max_workers):
+            offer_id, kind = bulk_result.id[:2]
+            result = results[offer_id]
+            if not bulk_result.ok:
+                result.errors[kind] = bulk_result.error
+                done(offer_id)
+                continue
+            process_status = bulk_result.value
+            if process_status is None:
+                result.skipped.add(kind)
+                done(offer_id)
+                continue
+            result.process_statuses[kind] = process_status
+            if process_status.status == "SUCCESS":
+                self.remember(offer_id, kind, result.changes)
+            if not self.wait or process_status.status != "PENDING":
+                done(offer_id)
+                continue
+            process_id = str(process_status.processStatusId)
+            by_process_id[process_id] = (offer_id, kind)
+            pending.append(process_status)
+
+        if pending:
+            try:
+                for process_status in self.api.process_status.wait_all(
+                        pending, timeout=self.timeout):
+                    offer_id, kind = by_process_id[
+                        str(process_status.processStatusId)]
+                    result = results[offer_id]
+                    result.process_statuses[kind] = process_status
+                    if process_status.status == "SUCCESS":
+                        self.remember(offer_id, kind, result.changes)
+                    done(offer_id)
+            except ProcessStatusTimeout as e:
+                # Report the offers still pending with their last status
+                for process_status in e.pending:
+                    offer_id, kind = by_process_id[
+                        str(process_status.processStatusId)]
+                    results[offer_id].process_statuses[kind] = process_status
+                    done(offer_id)
+        return results
+
+
+class OrderItemsResult(object):
+    """
+    Outcome of one request for several order items (`order_item_ids`):
+    either the (final, when waited for) `process_status` is set, or the
+    exception raised when submitting it is available as `error`.
+    """
+
+    def __init__(self, order_item_ids):
+        self.order_item_ids = order_item_ids
+        self.process_status = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return (self.error is None and self.process_status is not None and
+                self.process_status.status == "SUCCESS")
+
+    def __repr__(self):
+        if self.error is not None:
+            outcome = repr(self.error)
+        else:
+            outcome = getattr(self.process_status, "status", None)
+        return "<{} {!r}: {}>".format(
+            type(self).__name__, self.order_item_ids, outcome)
+
+
+class ShipmentResult(OrderItemsResult):
+    """
+    Outcome of one shipment request of `BulkShipper`, shared by the order
+    items it shipped.
+    """
+
+    def __init__(self, order_item_ids, shipment):
+        super(ShipmentResult, self).__init__(order_item_ids)
+        self.shipment = shipment
+
+
+class CancellationResult(OrderItemsResult):
+    """
+    Outcome of one cancellation request of `BulkCanceller`, shared by the
+    order items it cancelled; `reason_codes` maps them to their reasons.
+    """
+
+    def __init__(self, reason_codes):
+        super(CancellationResult, self).__init__(list(reason_codes))
+        self.reason_codes = reason_codes
+
+
+class OrderItemsBatcher(object):
+    """
+    Base of the bulk operations that send one request per batch of order
+    items: `run` submits the batches made by `batches(items)` concurrently
+    with `submit(result)` and tracks the resulting process statuses
+    together. It returns an ordered dict of results keyed by order item
+    id, where the items of a batch share their result; `on_result` is
+    called with each result as soon as it is final. Batches still pending
+    after `timeout` seconds are reported with their last (PENDING) process
+    status.
+    """
+
+    def __init__(self, api, max_workers=8, wait=True, timeout=None,
+                 on_result=None):
+        self.api = api
+        self.max_workers = max_workers
+        self.wait = wait
+        self.timeout = timeout
+        self.on_result = on_result
+
+    def batches(self, items):
+        raise NotImplementedError
+
+    def submit(self, result):
+        raise NotImplementedError
+
+    def run(self, items):
+        report = OrderedDict()
+        batches = self.batches(items)
+        for result in batches:
+            for order_item_id in result.order_item_ids:
+                report[order_item_id] = result
+
+        def done(result):
+            if self.on_result is not None:
+                self.on_result(result)
+
+        by_process_id = {}
+        pending = []
+        for bulk_result in iter_many(
+                self.submit, batches, max_workers=self.max_workers):
+            result = bulk_result.id
+            if not bulk_result.ok:
+                result.error = bulk_result.error
+                done(result)
+                continue
+            process_status = bulk_result.value
+            result.process_status = process_status
+            if not self.wait or process_status.status != "PENDING":
+                done(result)
+                continue
+            by_process_id[str(process_status.processStatusId)] = result
+            pending.append(process_status)
+
+        if pending:
+            try:
+                for process_status in self.api.process_status.wait_all(
+                        pending, timeout=self.timeout):
+                    result = by_process_id[
+                        str(process_status.processStatusId)]
+                    result.process_status = process_status
+                    done(result)
+            except ProcessStatusTimeout as e:
+                # Report the batches still pending with their last status
+                for process_status in e.pending:
+                    result = by_process_id[
+                        str(process_status.processStatusId)]
+                    result.process_status = process_status
+                    done(result)
+        return report
+
+
+class BulkShipper(OrderItemsBatcher):
+    """
+    Ships many order items, sending one shipment request for all items of
+    an order that share a shipment reference, shipping label and
+    transport::
+
+        shipper = BulkShipper(api, max_workers=8)
+        report = shipper.run([
+            {'order_item_id': '6042823871', 'order_id': '4123456789',
+             'transporter_code': 'TNT', 'track_and_trace': '3SAOLD1234567'},
+            {'order_item_id': '6042823872', 'order_id': '4123456789',
+             'transporter_code': 'TNT', 'track_and_trace': '3SAOLD1234567'},
+        ])
+
+    Each item is a dict with the arguments of `orders.ship_order_item`
+    and the `order_id` the item belongs to. Items without an `order_id`
+    cannot be grouped and are shipped one per request. `run` returns a
+    `ShipmentResult` per order item id, see `OrderItemsBatcher`.
+    """
+
+    SHIPMENT_KEYS = (
+        "shipment_reference",
+        "shipping_label_id",
+        "transporter_code",
+        "track_and_trace",
+    )
+
+    @classmethod
+    def group(cls, items):
+        groups = OrderedDict()
+        for item in items:
+            order_item_id = item["order_item_id"]
+            order_id = item.get("order_id")
+            shipment = tuple(item.get(key) for key in cls.SHIPMENT_KEYS)
+            if order_id is None:
+                key = (None, order_item_id) + shipment
+            else:
+                key = (order_id,) + shipment
+            groups.setdefault(key, []).append(order_item_id)
+        size = len(cls.SHIPMENT_KEYS)
+        return [
+            ShipmentResult(
+                order_item_ids, dict(zip(cls.SHIPMENT_KEYS, key[-size:])))
+            for key, order_item_ids in groups.items()
+        ]
+
+    def batches(self, items):
+        return self.group(items)
+
+    def submit(self, result):
+        return self.api.orders.ship_order_items(
+            result.order_item_ids, **result.shipment)
+
+
+class BulkCanceller(OrderItemsBatcher):
+    """
+    Cancels many order items with at most `max_items` per request::
+
+        canceller = BulkCanceller(api)
+        report = canceller.run([
+            ('6042823871', CancellationReasonCode.OUT_OF_STOCK),
+            ('6042823872', CancellationReasonCode.OUT_OF_STOCK),
+        ])
+
+    Items are given as `(order_item_id, reason_code)`, or as
+    `(order_item_id, reason_code, order_id)` to keep the items of an order
+    in the same request(s) with `group_by_order`. All reason codes are
+    checked before anything is sent: an unknown one raises `ValueError`.
+    When an item is given more than once, its last reason code wins.
+    `run` returns a `CancellationResult` per order item id, see
+    `OrderItemsBatcher`.
+    """
+
+    def __init__(self, api, max_items=50, group_by_order=False, **kwargs):
+        super(BulkCanceller, self).__init__(api, **kwargs)
+        self.max_items = max_items
+        self.group_by_order = group_by_order
+
+    def batches(self, items):
+        groups = OrderedDict()
+        order_ids = {}
+        for item in items:
+            order_item_id, reason_code = item[:2]
+            reason_code = CancellationReasonCode.to_string(reason_code)
+            order_id = None
+            if self.group_by_order and len(item) > 2:
+                order_id = item[2]
+            if order_item_id in order_ids:
+                del groups[order_ids[order_item_id]][order_item_id]
+            order_ids[order_item_id] = order_id
+            groups.setdefault(order_id, OrderedDict())[
+                order_item_id] = reason_code
+
+        batches = []
+        for group in groups.values():
+            order_item_ids = list(group)
+            for i in range(0, len(order_item_ids), self.max_items):
+                batches.append(CancellationResult(OrderedDict(
+                    (order_item_id, group[order_item_id])
+                    for order_item_id in order_item_ids[i:i + self.max_items]
+                )))
+        return batches
+
+    def submit(self, result):
+        return self.api.orders.cancel_order_items(
+            result.reason_codes.items())
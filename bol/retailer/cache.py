@@ -0,0 +1,142 @@
+"""
+Client-side cache of retailer API responses.
+"""
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import requote_uri
+from urllib.parse import urlencode
+
+from .storage import MemoryStore
+
+__all__ = ["ResponseCache"]
+
+
+def _response(entry):
+    resp = requests.Response()
+    resp.status_code = entry["status"]
+    resp.reason = entry["reason"]
+    resp.headers = CaseInsensitiveDict(entry["headers"])
+    resp.url = entry["url"]
+    resp.encoding = entry["encoding"]
+    resp._content = entry["content"]
+    resp.from_cache = True
+    return resp
+
+
+class ResponseCache(object):
+    """
+    Caches the responses to GET requests of the method groups given a TTL
+    in `ttls` (by group name, e.g. "invoices" or "orders"), or
+    `default_ttl`. Responses are kept in a `bol.retailer.storage` store:
+    an in-process LRU by default, or e.g. an `SQLiteStore` to share them
+    between processes::
+
+        cache = ResponseCache(SQLiteStore('responses.db'),
+                              ttls={'invoices': 24 * 3600, 'orders': 300})
+        api = RetailerAPI(response_cache=cache)
+
+    A response served from the cache has `from_cache` set. Once an entry
+    is older than its TTL, it is revalidated with `If-None-Match` /
+    `If-Modified-Since` when the server sent an `ETag` / `Last-Modified`,
+    and downloaded again otherwise. Entries that can be revalidated are
+    kept for `max_stale` seconds past their TTL.
+
+    Cached responses are not invalidated by updates made through the API,
+    so choose TTLs by how stale the data may be. Responses are keyed by
+    URL and `Accept` header only: do not share a cache between retailer
+    accounts.
+    """
+
+    def __init__(self, store=None, ttls=None, default_ttl=None,
+                 max_stale=24 * 3600, clock=time.time):
+        self.store = store if store is not None else MemoryStore(1000)
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0, "misses": 0, "revalidated": 0, "stored": 0}
+
+    def ttl(self, group):
+        return self.ttls.get(group, self.default_ttl)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def clear(self):
+        self.store.clear()
+
+    def key(self, api, request_kwargs):
+        url = request_kwargs["url"]
+        params = request_kwargs.get("params")
+        if params:
+            url += "?" + urlencode(sorted(params.items()))
+        headers = CaseInsensitiveDict(api.session.headers)
+        headers.update(request_kwargs.get("headers") or {})
+        return "{} {}".format(requote_uri(url), headers.get("Accept"))
+
+    def request(self, api, group, request_kwargs, send):
+        """
+        Returns the response to `request_kwargs`, from the cache or from
+        `send(request_kwargs)`.
+        """
+        ttl = self.ttl(group)
+        if (ttl is None or request_kwargs["method"] != "GET" or
+                request_kwargs.get("stream")):
+            return send(request_kwargs)
+        key = self.key(api, request_kwargs)
+        entry = self.store.get(key)
+        if entry is not None and entry["expires"] > self.clock():
+            self.count("hits")
+            return _response(entry)
+
+        validators = {}
+        if entry is not None:
+            cached = CaseInsensitiveDict(entry["headers"])
+            if cached.get("ETag"):
+                validators["If-None-Match"] = cached["ETag"]
+            if cached.get("Last-Modified"):
+                validators["If-Modified-Since"] = cached["Last-Modified"]
+        if validators:
+            request_kwargs = dict(request_kwargs)
+            headers = dict(request_kwargs.get("headers") or {})
+            headers.update(validators)
+            request_kwargs["headers"] = headers
+        resp = send(request_kwargs)
+
+        if validators and resp.status_code == 304:
+            self.count("revalidated")
+            entry = dict(entry, expires=self.clock() + ttl)
+            self.store.set(key, entry, ttl=ttl + self.max_stale)
+            return _response(entry)
+        self.count("misses")
+        if resp.status_code == 200 and "no-store" not in \
+                resp.headers.get("Cache-Control", ""):
+            self.save(key, resp, ttl)
+        return resp
+
+    def save(self, key, resp, ttl):
+        headers = dict(resp.headers)
+        entry = {
+            "status": resp.status_code,
+            "reason": resp.reason,
+            "headers": headers,
+            "url": resp.url,
+            "encoding": resp.encoding,
+            "content": resp.content,
+            "expires": self.clock() + ttl,
+        }
+        keep = ttl
+        if "ETag" in resp.headers or "Last-Modified" in resp.headers:
+            keep += self.max_stale
+        self.store.set(key, entry, ttl=keep)
+        self.count("stored")
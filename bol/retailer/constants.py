@@ -43,6 +43,10 @@ class TransporterCode:
 
 
 class CancellationReasonCode:
+    """
+    https://api.bol.com/retailer/public/redoc/v3#tag/Orders
+    """
+
     OUT_OF_STOCK = "OUT_OF_STOCK"
     REQUESTED_BY_CUSTOMER = "REQUESTED_BY_CUSTOMER"
     BAD_CONDITION = "BAD_CONDITION"
@@ -55,3 +59,15 @@ class CancellationReasonCode:
     TECH_ISSUE = "TECH_ISSUE"
     UNFINDABLE_ITEM = "UNFINDABLE_ITEM"
     OTHER = "OTHER"
+
+    @classmethod
+    def to_string(cls, reason_code):
+        """
+        Returns `reason_code` if it is a known reason code, and raises
+        `ValueError` otherwise.
+        """
+        if (not isinstance(reason_code, str) or
+                getattr(cls, reason_code, None) != reason_code):
+            raise ValueError(
+                "Unknown cancellation reason code: {!r}".format(reason_code))
+        return reason_code
@@ -0,0 +1,58 @@
+"""
+JSON decoders for retailer API responses.
+
+A decoder turns a response body, `bytes` (preferably, as it saves
+decoding the body to text first) or `str`, into Python data.
+
+By default numbers with a fraction are decoded as `Decimal`s, as written
+in the response. Decoding them as floats is faster, in particular with
+`orjson`, but then only the fields declared as `DecimalField` become
+`Decimal`s again, converted from the float (see `DecimalField.parse`);
+amounts in undeclared fields stay floats. Opt in with::
+
+    api = RetailerAPI(decoder=OrjsonDecoder())
+"""
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = ["JSONDecoder", "OrjsonDecoder", "default_decoder"]
+
+
+class JSONDecoder(object):
+    """
+    Decoder using the standard library `json` module. Numbers with a
+    fraction are decoded with `parse_float`; pass `float` for floats.
+    """
+
+    name = "json"
+
+    def __init__(self, parse_float=Decimal):
+        self.parse_float = parse_float
+
+    def decode(self, content):
+        return json.loads(content, parse_float=self.parse_float)
+
+
+class OrjsonDecoder(object):
+    """
+    Decoder using `orjson`, which parses `bytes` directly. It always
+    decodes numbers with a fraction as floats.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("OrjsonDecoder requires the orjson package")
+
+    def decode(self, content):
+        return orjson.loads(content)
+
+
+def default_decoder():
+    return JSONDecoder()
@@ -0,0 +1,243 @@
+"""
+Streaming reader for the CSV offer export (`offers.getOffersFile`).
+
+The export is parsed while it downloads, one `OfferExportRow` at a time,
+so memory use does not grow with the number of offers. `OfferExport`
+runs the whole request / poll / download / parse pipeline.
+"""
+import codecs
+import csv
+import json
+import os
+import time
+
+import requests
+
+from .models import OfferExportRow
+
+__all__ = [
+    "OfferExport",
+    "OfferExportError",
+    "iter_offer_export",
+    "iter_offer_export_file",
+]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_text_lines(chunks, encoding="utf-8-sig"):
+    """
+    Decodes an iterable of byte chunks into lines, keeping the line
+    endings so that `csv` can deal with line breaks inside quoted values.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if "\n" not in buffer:
+            continue
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+def _write_through(chunks, f):
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def iter_offer_export(api, chunks, write_to=None):
+    """
+    Yields an `OfferExportRow` per CSV record in `chunks` (an iterable of
+    bytes). Empty values are parsed as `None`. The rows are recorded in
+    the API's offer cache, if it has one.
+
+    `write_to` (a path or a binary file object) receives a verbatim copy
+    of the downloaded bytes as they stream by.
+    """
+    f = None
+    if write_to is not None:
+        if hasattr(write_to, "write"):
+            chunks = _write_through(chunks, write_to)
+        else:
+            f = open(write_to, "wb")
+            chunks = _write_through(chunks, f)
+    cache = getattr(api, "offer_cache", None)
+    try:
+        for row in csv.DictReader(iter_text_lines(chunks)):
+            row = OfferExportRow.parse(
+                api,
+                dict(
+                    (key, value if value != "" else None)
+                    for key, value in row.items()
+                ),
+            )
+            if cache is not None:
+                cache.update_from_export_row(row)
+            yield row
+    finally:
+        if f is not None:
+            f.close()
+
+
+def iter_offer_export_file(api, path, chunk_size=CHUNK_SIZE):
+    """
+    Same as `iter_offer_export`, reading a previously saved export file.
+    """
+    with open(path, "rb") as f:
+        for row in iter_offer_export(
+                api, iter(lambda: f.read(chunk_size), b"")):
+            yield row
+
+
+class OfferExportError(Exception):
+    pass
+
+
+class OfferExport(object):
+    """
+    Request an offer export, wait for it, download it and parse it::
+
+        export = OfferExport(api, workdir='/var/lib/repricer')
+        for row in export.rows():
+            ...
+
+    With a `workdir` the pipeline is resumable: the process status and
+    export ids are checkpointed in `offers-export.json` and the CSV is
+    downloaded to `offers-export.csv`, so a restarted process picks up
+    where the previous one stopped. An interrupted download is continued
+    with a `Range` request when the server supports it, and started over
+    otherwise. A checkpoint older than `max_age` seconds is discarded, as
+    the offers will have changed since. Once all rows have been read, the
+    checkpoint and the CSV are removed, so that the next export is a new
+    one.
+
+    Without a `workdir` the export is parsed straight off the wire.
+    """
+
+    state_name = "offers-export.json"
+    csv_name = "offers-export.csv"
+
+    def __init__(self, api, workdir=None, max_age=1800, timeout=3600,
+                 chunk_size=CHUNK_SIZE):
+        self.api = api
+        self.workdir = workdir
+        self.max_age = max_age
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.state = {}
+        if workdir is not None:
+            self.state_path = os.path.join(workdir, self.state_name)
+            self.csv_path = os.path.join(workdir, self.csv_name)
+            self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if (self.max_age is not None and
+                time.time() - state.get("created", 0) > self.max_age):
+            self.reset()
+            return {}
+        return state
+
+    def save_state(self):
+        if self.workdir is None:
+            return
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def reset(self):
+        self.state = {}
+        for path in (self.state_path, self.csv_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def export_id(self):
+        if self.state.get("export_id"):
+            return self.state["export_id"]
+        if not self.state.get("process_id"):
+            process_status = self.api.offers.requestExportFile()
+            self.state = {
+                "created": time.time(),
+                "process_id": str(process_status.processStatusId),
+            }
+            self.save_state()
+        process_status = self.api.process_status.wait(
+            self.state["process_id"], timeout=self.timeout)
+        if process_status.status != "SUCCESS":
+            if self.workdir is not None:
+                self.reset()
+            raise OfferExportError(
+                "Offer export {}: {}".format(
+                    process_status.status,
+                    getattr(process_status, "errorMessage", None)))
+        self.state["export_id"] = str(process_status.entityId)
+        self.save_state()
+        return self.state["export_id"]
+
+    def download(self):
+        """
+        Downloads the export to the working directory, continuing a
+        partial download.
+        """
+        if self.state.get("complete"):
+            return
+        export_id = self.export_id()
+        offset = 0
+        if os.path.exists(self.csv_path):
+            offset = os.path.getsize(self.csv_path)
+        headers = {"accept": "application/vnd.retailer.v4+csv"}
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+        try:
+            response = self.api.offers.request(
+                "GET", path="export/{}".format(export_id), headers=headers,
+                stream=True)
+        except requests.HTTPError as e:
+            # 416: the previous run got all of it, but died before saying so
+            if e.response is None or e.response.status_code != 416:
+                raise
+            self.state["complete"] = True
+            self.save_state()
+            return
+        try:
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(self.csv_path, mode) as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+        finally:
+            response.close()
+        self.state["complete"] = True
+        self.save_state()
+
+    def rows(self):
+        """
+        Returns an iterator of `OfferExportRow`, one per offer.
+        """
+        if self.workdir is None:
+            return self.api.offers.iter_offers_file(
+                self.export_id(), chunk_size=self.chunk_size)
+        self.download()
+        return self._iter_downloaded_rows()
+
+    def _iter_downloaded_rows(self):
+        for row in iter_offer_export_file(self.api, self.csv_path,
+                                          chunk_size=self.chunk_size):
+            yield row
+        self.reset()
+
+    def table(self, key="offerId"):
+        """
+        Returns the offers as a dict indexed by `key`.
+        """
+        return dict((getattr(row, key), row) for row in self.rows())
@@ -1,23 +1,39 @@
 import json
-import sys
-from datetime import date
+from datetime import date, datetime
 from decimal import Decimal
 
-import dateutil.parser
-
-
-def _is_str(v):
-    if sys.version_info >= (3, 0, 0):
-        string_types = str,
-    else:
-        string_types = basestring,
-    return isinstance(v, string_types)
+from ..compact import CompactMixin, ModelType, parse_options
+from ..dateparse import parse_datetime
+from .decoders import default_decoder
 
 
 def parse_json(content):
     return json.loads(content, parse_float=Decimal)
 
 
+_default_decoder = default_decoder()
+
+
+def to_raw(value):
+    """
+    Turns parsed values back into JSON-like data: models into dicts (or
+    lists), dates and datetimes into ISO 8601 strings.
+    """
+    if isinstance(value, ModelList):
+        return [to_raw(item) for item in value]
+    if isinstance(value, BaseModel):
+        return dict(
+            (key, to_raw(v)) for key, v in value._values().items()
+            if key not in ("raw_content", "raw_data"))
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [to_raw(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, to_raw(v)) for key, v in value.items())
+    return value
+
+
 class Field(object):
     def parse(self, api, raw_data, instance):
         raise NotImplementedError
@@ -30,12 +46,29 @@ class RawField(Field):
 
 class DecimalField(Field):
     def parse(self, api, raw_data, instance):
+        # With a float decoder: the shortest repr of a float is the number
+        # it was read from, less trailing zeros, so 12.90 becomes
+        # Decimal('12.9') rather than the binary value.
+        if isinstance(raw_data, float):
+            raw_data = repr(raw_data)
         return Decimal(raw_data)
 
 
+class IntegerField(Field):
+    def parse(self, api, raw_data, instance):
+        return int(raw_data)
+
+
+class BooleanField(Field):
+    def parse(self, api, raw_data, instance):
+        if isinstance(raw_data, bool):
+            return raw_data
+        return raw_data.lower() == "true"
+
+
 class DateTimeField(Field):
     def parse(self, api, raw_data, instance):
-        return dateutil.parser.parse(raw_data)
+        return parse_datetime(raw_data)
 
 
 class DateField(Field):
@@ -55,38 +88,145 @@ class ModelField(Field):
         return self.model.parse(api, xml)
 
 
-class BaseModel(object):
+class BaseModel(CompactMixin, metaclass=ModelType):
     @classmethod
-    def parse(cls, api, content):
-        m = cls()
-        if _is_str(content):
-            m.raw_content = content
-            m.raw_data = parse_json(content)
+    def fields(cls):
+        """
+        The typed `Field`s declared on `Meta`, by name. Collected once per
+        class; keys without a declared field are taken over as is.
+        """
+        fields = cls.__dict__.get("_fields")
+        if fields is None:
+            meta = getattr(cls, "Meta", None)
+            fields = {}
+            for name in dir(meta):
+                field = getattr(meta, name)
+                if (isinstance(field, Field) and
+                        not isinstance(field, RawField)):
+                    fields[name] = field
+            cls._fields = fields
+        return fields
+
+    @classmethod
+    def create(cls, api, content, keys=False):
+        """
+        Decodes `content` (JSON bytes or text, with the API's `decoder`)
+        and creates the instance to parse it into. Returns the instance
+        and the decoded data.
+
+        In compact mode (`RetailerAPI(compact=True)`) the instance has
+        slots for the kept raw payload and, with `keys`, the keys of the
+        data instead of a `__dict__`.
+        """
+        if isinstance(content, (bytes, str)):
+            decoder = getattr(api, "decoder", None) or _default_decoder
+            raw_content, raw_data = content, decoder.decode(content)
         else:
-            m.raw_content = None
-            m.raw_data = content
-        return m
+            raw_content, raw_data = None, content
+        compact, keep_raw = parse_options(api)
+        names = ("raw_content", "raw_data") if keep_raw else ()
+        if compact:
+            if keys:
+                names += tuple(raw_data)
+                if getattr(api, "lazy", False):
+                    names += ("_pending",)
+            m = cls.compact_class(names)()
+        else:
+            m = cls()
+        if keep_raw:
+            if isinstance(raw_content, bytes):
+                raw_content = raw_content.decode("utf-8")
+            m.raw_content = raw_content
+            m.raw_data = raw_data
+        return m, raw_data
+
+    @classmethod
+    def parse(cls, api, content):
+        return cls.create(api, content)[0]
+
+    @property
+    def raw(self):
+        """
+        The data the object was parsed from. Unless it was kept, it is
+        rebuilt from the parsed values with `to_raw` (for lists: from the
+        items only).
+        """
+        try:
+            return self.raw_data
+        except AttributeError:
+            return to_raw(self)
 
 
 class Model(BaseModel):
+    """
+    With `RetailerAPI(lazy=True)` only the untyped values are set while
+    parsing. Those with a declared `Field` (nested models, dates,
+    decimals) are kept in `_pending` as decoded, and parsed the first time
+    they are accessed.
+    """
+
     @classmethod
     def parse(cls, api, content):
-        m = super(Model, cls).parse(api, content)
-        for tag, v in m.raw_data.items():
-            field = getattr(m.Meta, tag, RawField())
-            setattr(m, tag, field.parse(api, v, m))
+        m, raw_data = cls.create(api, content, keys=True)
+        get_field = cls.fields().get
+        compact = type(m)._shape is not None
+        lazy = getattr(api, "lazy", False)
+        values = {} if compact else m.__dict__
+        pending = {}
+        for tag, v in raw_data.items():
+            field = get_field(tag)
+            if field is not None and v is not None:
+                if lazy:
+                    pending[tag] = v
+                    continue
+                v = field.parse(api, v, m)
+            values[tag] = v
+        if compact:
+            m._set_values(values)
+        if pending:
+            object.__setattr__(m, "_pending", (api, pending))
         return m
 
+    def _get_pending(self):
+        try:
+            return object.__getattribute__(self, "_pending")
+        except AttributeError:
+            return None, None
+
+    def __getattr__(self, name):
+        api, pending = self._get_pending()
+        if pending is None or name not in pending:
+            return super(Model, self).__getattr__(name)
+        field = type(self).model_class().fields()[name]
+        value = field.parse(api, pending[name], self)
+        self._set_values({name: value})
+        pending.pop(name, None)
+        return value
+
+    def _hydrate(self):
+        """
+        Parses all pending values.
+        """
+        api, pending = self._get_pending()
+        for name in list(pending or ()):
+            getattr(self, name)
+
+    def _values(self):
+        self._hydrate()
+        values = super(Model, self)._values()
+        values.pop("_pending", None)
+        return values
+
 
 class ModelList(list, BaseModel):
     @classmethod
     def parse(cls, api, content):
-        ml = super(ModelList, cls).parse(api, content)
+        ml, raw_data = cls.create(api, content)
         items_key = getattr(ml.Meta, "items_key", None)
         if items_key:
-            items = ml.raw_data.get(items_key)
+            items = raw_data.get(items_key)
         else:
-            items = ml.raw_data
+            items = raw_data
         if items:
             for item in items:
                 ml.append(ml.Meta.item_type.parse(api, item))
@@ -156,6 +296,8 @@ class OrderItem(Model):
         additionalServices = ModelField(additionalServices)
         offerPrice = DecimalField()
         transactionFee = DecimalField()
+        unitPrice = DecimalField()
+        commission = DecimalField()
 
 
 class OrderItems(ModelList):
@@ -179,6 +321,9 @@ class ShipmentItem(Model):
     class Meta:
         orderDate = DateTimeField()
         latestDeliveryDate = DateTimeField()
+        offerPrice = DecimalField()
+        unitPrice = DecimalField()
+        commission = DecimalField()
 
 
 class ShipmentItems(ModelList):
@@ -340,3 +485,16 @@ class ReturnItems(ModelList):
     class Meta:
         items_key = 'returns'
         item_type = ReturnItem
+
+
+class OfferExportRow(Model):
+    """
+    One offer of the CSV offer export, see `bol.retailer.export`.
+    """
+
+    class Meta:
+        bundlePricesPrice = DecimalField()
+        stockAmount = IntegerField()
+        correctedStock = IntegerField()
+        onHoldByRetailer = BooleanField()
+        mutationDateTime = DateTimeField()
@@ -0,0 +1,145 @@
+"""
+Local cache of the price and stock bol.com has for each offer, so that
+updates that would not change anything can be skipped.
+"""
+import time
+from decimal import Decimal
+
+from .storage import MemoryStore
+
+__all__ = ["OfferStateCache"]
+
+
+def _bundle_prices(bundle_prices):
+    return sorted(
+        (int(p["quantity"]), Decimal(str(p["unitPrice"])))
+        for p in bundle_prices
+    )
+
+
+class OfferStateCache(object):
+    """
+    Price and stock per offer id, kept in a `bol.retailer.storage` store
+    (an in-process LRU by default, or e.g. an `SQLiteStore` shared between
+    runs) with an optional `ttl` in seconds::
+
+        cache = OfferStateCache(SQLiteStore('offers.db'), ttl=6 * 3600)
+        api = RetailerAPI(offer_cache=cache)
+
+    It is filled by `offers.getSingleOffer` and the offer export, and
+    consulted by `offers.updateProductPrice` / `updateProductStock`, which
+    skip (and return `None` for) updates matching the cached state.
+    Submitting an update forgets the state of the offer, as it is unknown
+    until the process status succeeds; `offers.bulk_update` stores the new
+    state when it does.
+
+    Each field is stored with the time it was set and expires `ttl`
+    seconds after that, so refreshing the stock of an offer does not keep
+    a stale price alive.
+    """
+
+    def __init__(self, store=None, ttl=None, clock=time.time):
+        self.store = store if store is not None else MemoryStore(100000)
+        self.ttl = ttl
+        self.clock = clock
+
+    def _fresh_fields(self, offer_id):
+        fields = self.store.get(str(offer_id)) or {}
+        if self.ttl is None:
+            return dict(fields)
+        expired = self.clock() - self.ttl
+        return dict(
+            (key, (value, stored))
+            for key, (value, stored) in fields.items() if stored > expired)
+
+    def _save(self, offer_id, fields):
+        if fields:
+            self.store.set(str(offer_id), fields, ttl=self.ttl)
+        else:
+            self.store.delete(str(offer_id))
+
+    def get(self, offer_id):
+        return dict(
+            (key, value)
+            for key, (value, _) in self._fresh_fields(offer_id).items())
+
+    def update(self, offer_id, bundle_prices=None, amount=None,
+               managed_by_retailer=None):
+        fields = self._fresh_fields(offer_id)
+        now = self.clock()
+        if bundle_prices is not None:
+            fields["bundlePrices"] = (_bundle_prices(bundle_prices), now)
+        if amount is not None:
+            fields["amount"] = (int(amount), now)
+        if managed_by_retailer is not None:
+            fields["managedByRetailer"] = (managed_by_retailer, now)
+        self._save(offer_id, fields)
+
+    def invalidate(self, offer_id, *keys):
+        """
+        Forgets `keys` (all of the offer's state when none are given).
+        """
+        if not keys:
+            self.store.delete(str(offer_id))
+            return
+        fields = self._fresh_fields(offer_id)
+        for key in keys:
+            fields.pop(key, None)
+        self._save(offer_id, fields)
+
+    def update_from_offer(self, offer):
+        """
+        Stores the state of an `OffersResponse`.
+        """
+        bundle_prices = None
+        pricing = getattr(offer, "pricing", None)
+        if pricing is not None and getattr(pricing, "bundlePrices", None):
+            bundle_prices = [
+                {"quantity": p.quantity, "unitPrice": p.unitPrice}
+                for p in pricing.bundlePrices
+            ]
+        stock = getattr(offer, "stock", None)
+        self.update(
+            offer.offerId,
+            bundle_prices=bundle_prices,
+            amount=getattr(stock, "amount", None),
+            managed_by_retailer=getattr(stock, "managedByRetailer", None),
+        )
+
+    def update_from_export_row(self, row):
+        """
+        Stores the state of an `OfferExportRow`.
+        """
+        bundle_prices = None
+        if row.bundlePricesPrice is not None:
+            bundle_prices = [
+                {"quantity": 1, "unitPrice": row.bundlePricesPrice}]
+        self.update(
+            row.offerId, bundle_prices=bundle_prices, amount=row.stockAmount)
+
+    def price_unchanged(self, offer_id, data):
+        """
+        Tells whether the `updateProductPrice` payload `data` matches the
+        cached price.
+        """
+        cached = self.get(offer_id).get("bundlePrices")
+        try:
+            bundle_prices = _bundle_prices(data["pricing"]["bundlePrices"])
+        except (KeyError, TypeError):
+            return False
+        return cached is not None and cached == bundle_prices
+
+    def stock_unchanged(self, offer_id, data):
+        """
+        Tells whether the `updateProductStock` payload `data` matches the
+        cached stock. The export does not include `managedByRetailer`, in
+        which case only the amount is compared.
+        """
+        state = self.get(offer_id)
+        if "amount" not in state or "amount" not in data:
+            return False
+        if state["amount"] != int(data["amount"]):
+            return False
+        managed = state.get("managedByRetailer")
+        return (managed is None or
+                managed == data.get("managedByRetailer", False))
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from ..retry import parse_retry_after
+
+__all__ = ["RateLimiter", "TokenBucket"]
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket. Callers reserve a token and are told how long
+    to wait for it, so nobody sleeps while holding the lock.
+
+    The rate adapts at runtime: `throttle()` (on a 429) halves it and
+    blocks the bucket for the `Retry-After` period, every successful call
+    gives back a twentieth of the configured rate until it is reached
+    again.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = self.max_rate / 16
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(now - self.updated, 0.0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds to wait before it
+        may be used.
+        """
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def observe(self, remaining=None, reset=None):
+        """
+        Aligns the bucket with the server's view of the remaining quota.
+        """
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+            if self.rate < self.max_rate:
+                self.rate = min(
+                    self.max_rate, self.rate + self.max_rate / 20)
+
+    def throttle(self, retry_after=None):
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after is None:
+                retry_after = 1 / self.rate
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+class RateLimiter(object):
+    """
+    Client-side rate limiter for `RetailerAPI`, keyed by
+    `MethodGroup.group` (e.g. "orders", "process-status")::
+
+        limiter = RateLimiter(limits={
+            'orders': (25, 25),     # requests per second, burst size
+            'offers': 50,
+        })
+        api = RetailerAPI(rate_limiter=limiter)
+
+    The rate limit response headers and `Retry-After` feed back into the
+    bucket of the group. A single limiter may be shared by several API
+    instances, threads and `AsyncRetailerAPI`.
+    """
+
+    remaining_header = "X-RateLimit-Remaining"
+    reset_header = "X-RateLimit-Reset"
+
+    def __init__(
+        self,
+        limits=None,
+        default=(10, 10),
+        max_retries=3,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        self.limits = dict(limits or {})
+        self.default = default
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, group):
+        with self.lock:
+            bucket = self.buckets.get(group)
+            if bucket is None:
+                limit = self.limits.get(group, self.default)
+                if not isinstance(limit, (tuple, list)):
+                    limit = (limit, None)
+                bucket = TokenBucket(limit[0], limit[1], clock=self.clock)
+                self.buckets[group] = bucket
+            return bucket
+
+    def acquire(self, group):
+        wait = self.bucket(group).reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+    def update(self, group, response):
+        bucket = self.bucket(group)
+        headers = response.headers
+        if response.status_code == 429:
+            bucket.throttle(parse_retry_after(headers.get("Retry-After")))
+        else:
+            bucket.observe(
+                remaining=_header_number(headers, self.remaining_header),
+                reset=_header_number(headers, self.reset_header),
+            )
@@ -0,0 +1,129 @@
+"""
+Key/value stores with per-entry expiry, used by the client-side caches.
+
+Both stores are thread-safe and share the same small interface:
+`get(key, default=None)`, `set(key, value, ttl=None)`, `delete(key)` and
+`clear()`.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ["MemoryStore", "SQLiteStore"]
+
+
+class MemoryStore(object):
+    """
+    In-process LRU store holding at most `maxsize` entries.
+    """
+
+    def __init__(self, maxsize=10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires <= self.clock():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None
+        if ttl is not None:
+            expires = self.clock() + ttl
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class SQLiteStore(object):
+    """
+    Store persisted in an SQLite database file, so that it survives
+    restarts and can be shared by worker processes on one machine. Values
+    are pickled.
+    """
+
+    def __init__(self, path, table="store", clock=time.time):
+        self.path = path
+        self.table = table
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "key TEXT PRIMARY KEY, value BLOB, expires REAL)".format(
+                    self.table))
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires FROM {} WHERE key = ?".format(
+                    self.table),
+                (key,)).fetchone()
+            if row is None:
+                return default
+            value, expires = row
+            if expires is not None and expires <= self.clock():
+                with self.connection:
+                    self.connection.execute(
+                        "DELETE FROM {} WHERE key = ?".format(self.table),
+                        (key,))
+                return default
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires = None
+        if ttl is not None:
+            expires = self.clock() + ttl
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO {} (key, value, expires) "
+                "VALUES (?, ?, ?)".format(self.table),
+                (key, sqlite3.Binary(value), expires))
+
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM {} WHERE key = ?".format(self.table), (key,))
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM {}".format(self.table))
+
+    def purge(self):
+        """
+        Removes the expired entries.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM {} WHERE expires <= ?".format(self.table),
+                (self.clock(),))
+
+    def close(self):
+        self.connection.close()
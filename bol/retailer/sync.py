@@ -0,0 +1,264 @@
+"""
+Incremental synchronisation of orders and shipments.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from .models import to_raw
+
+__all__ = ["OrderCheckpoint", "OrderEvent", "OrderSync"]
+
+
+def fingerprint(order):
+    """
+    Digest of what the order listing says about an order, which changes
+    when e.g. an item is cancelled or shipped.
+    """
+    data = json.dumps(to_raw(order), sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _shipment_order_ids(shipment):
+    raw = to_raw(shipment)
+    order_ids = []
+    order = raw.get("order") or {}
+    if order.get("orderId"):
+        order_ids.append(str(order["orderId"]))
+    for item in raw.get("shipmentItems") or ():
+        order_id = item.get("orderId")
+        if order_id and str(order_id) not in order_ids:
+            order_ids.append(str(order_id))
+    return order_ids
+
+
+class OrderEvent(object):
+    """
+    A change found by `OrderSync`: `kind` is "new" or "changed", with the
+    full `Order` as `order`, or "shipped", with the `shipment` (as listed)
+    that contains the order.
+    """
+
+    def __init__(self, kind, order_id, order=None, shipment=None):
+        self.kind = kind
+        self.order_id = order_id
+        self.order = order
+        self.shipment = shipment
+
+    def __repr__(self):
+        return "<OrderEvent {} {!r}>".format(self.kind, self.order_id)
+
+
+class OrderCheckpoint(object):
+    """
+    What `OrderSync` has seen so far, in an SQLite database file: the
+    fingerprint of every order with the time it was first seen and last
+    changed, and the ids of the shipments.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                "order_id TEXT PRIMARY KEY, fingerprint TEXT, "
+                "placed REAL, seen REAL, changed REAL, shipped REAL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS shipments ("
+                "shipment_id TEXT PRIMARY KEY, seen REAL)")
+
+    def fingerprints(self, order_ids):
+        """
+        Returns the fingerprint of each of `order_ids` that is known.
+        """
+        order_ids = [str(order_id) for order_id in order_ids]
+        if not order_ids:
+            return {}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT order_id, fingerprint FROM orders "
+                "WHERE order_id IN ({})".format(
+                    ", ".join("?" * len(order_ids))),
+                order_ids).fetchall()
+        return dict(rows)
+
+    def known_shipments(self, shipment_ids):
+        shipment_ids = [str(shipment_id) for shipment_id in shipment_ids]
+        if not shipment_ids:
+            return set()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT shipment_id FROM shipments "
+                "WHERE shipment_id IN ({})".format(
+                    ", ".join("?" * len(shipment_ids))),
+                shipment_ids).fetchall()
+        return set(row[0] for row in rows)
+
+    def save_order(self, order_id, fingerprint, placed=None):
+        """
+        Records the fingerprint of an order placed at `placed` (an aware
+        datetime, stored as a timestamp).
+        """
+        now = self.clock()
+        if placed is not None:
+            placed = placed.timestamp()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO orders "
+                "(order_id, placed, seen) VALUES (?, ?, ?)",
+                (str(order_id), placed, now))
+            self.connection.execute(
+                "UPDATE orders SET fingerprint = ?, changed = ? "
+                "WHERE order_id = ?",
+                (fingerprint, now, str(order_id)))
+
+    def save_shipment(self, shipment_id, order_ids=()):
+        now = self.clock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO shipments (shipment_id, seen) "
+                "VALUES (?, ?)",
+                (str(shipment_id), now))
+            for order_id in order_ids:
+                self.connection.execute(
+                    "UPDATE orders SET shipped = ? WHERE order_id = ?",
+                    (now, str(order_id)))
+
+    @property
+    def high_water_mark(self):
+        """
+        The latest `orderPlacedDateTime` seen, in UTC.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MAX(placed) FROM orders").fetchone()
+        if row[0] is None:
+            return None
+        return datetime.fromtimestamp(row[0], timezone.utc)
+
+    def prune(self, max_age):
+        """
+        Forgets the orders and shipments first seen more than `max_age`
+        seconds ago.
+        """
+        before = self.clock() - max_age
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM orders WHERE seen < ?", (before,))
+            self.connection.execute(
+                "DELETE FROM shipments WHERE seen < ?", (before,))
+
+    def close(self):
+        self.connection.close()
+
+
+class OrderSync(object):
+    """
+    Finds the orders that are new or changed since the previous run, and
+    the orders that were shipped, without re-reading the orders it
+    already has::
+
+        sync = OrderSync(api, OrderCheckpoint('orders.db'))
+        for event in sync.run():
+            handle(event.kind, event.order_id, event.order)
+
+    The order and shipment listings are paged, newest first, until a page
+    holds no unknown ids. Only the orders that are new, or whose listing
+    differs from the previous run, are fetched in full (concurrently, see
+    `orders.get_many`). Changes to orders on pages that are not reached
+    are picked up by a `run(full=True)`, which reads all pages.
+
+    An event is checkpointed once the consumer has taken it and asks for
+    the next one, so an interrupted run repeats (at least once) the
+    events it was interrupted at. Orders that could not be fetched are not
+    checkpointed, and come up again on the next run.
+    """
+
+    def __init__(self, api, checkpoint, fulfilment_method=None,
+                 shipments=True, max_workers=8):
+        self.api = api
+        self.checkpoint = checkpoint
+        self.fulfilment_method = fulfilment_method
+        self.shipments = shipments
+        self.max_workers = max_workers
+
+    def _iter_pages(self, fetch):
+        page = 1
+        items = fetch(page)
+        while items:
+            yield list(items)
+            page += 1
+            items = fetch(page)
+
+    def changed_orders(self, full=False):
+        """
+        Returns the listed orders that are new or changed, as a list of
+        `(order, fingerprint)`.
+        """
+        changed = []
+        pages = self._iter_pages(
+            lambda page: self.api.orders.list(
+                fulfilment_method=self.fulfilment_method, page=page))
+        for orders in pages:
+            known = self.checkpoint.fingerprints(o.orderId for o in orders)
+            for order in orders:
+                digest = fingerprint(order)
+                if known.get(str(order.orderId)) != digest:
+                    changed.append((order, digest))
+            if not full and len(known) == len(orders):
+                break
+        return changed
+
+    def new_shipments(self, full=False):
+        """
+        Returns the listed shipments that are not known yet.
+        """
+        new = []
+        pages = self._iter_pages(
+            lambda page: self.api.shipments.list(
+                fulfilment_method=self.fulfilment_method, page=page))
+        for shipments in pages:
+            known = self.checkpoint.known_shipments(
+                s.shipmentId for s in shipments)
+            new.extend(
+                s for s in shipments if str(s.shipmentId) not in known)
+            if not full and len(known) == len(shipments):
+                break
+        return new
+
+    def run(self, full=False):
+        """
+        Yields an `OrderEvent` per new, changed and shipped order.
+        """
+        checkpoint = self.checkpoint
+        changed = self.changed_orders(full=full)
+        known = checkpoint.fingerprints(
+            order.orderId for order, _ in changed)
+        digests = dict((str(order.orderId), digest)
+                       for order, digest in changed)
+        results = self.api.orders.get_many(
+            list(digests), max_workers=self.max_workers)
+        for result in results:
+            if not result.ok:
+                continue
+            order = result.value
+            kind = "changed" if result.id in known else "new"
+            yield OrderEvent(kind, result.id, order=order)
+            checkpoint.save_order(
+                result.id, digests[result.id],
+                getattr(order, "orderPlacedDateTime", None))
+
+        if not self.shipments:
+            return
+        for shipment in reversed(self.new_shipments(full=full)):
+            order_ids = _shipment_order_ids(shipment)
+            for order_id in order_ids:
+                yield OrderEvent("shipped", order_id, shipment=shipment)
+            checkpoint.save_shipment(shipment.shipmentId, order_ids)
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import requests
+
+__all__ = ["RetryPolicy"]
+
+
+def parse_retry_after(value):
+    """
+    `Retry-After` is either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max((when - datetime.now(when.tzinfo)).total_seconds(), 0.0)
+
+
+class RetryPolicy(object):
+    """
+    Retries transient failures (connection errors, timeouts and the
+    `retry_statuses`) with exponential backoff::
+
+        delay = min(max_backoff, backoff_factor * 2 ** (attempt - 1))
+
+    With `jitter` the delay is drawn uniformly from [0, delay] ("full
+    jitter"), so that many workers failing at once do not retry in
+    lockstep. A `Retry-After` header raises the delay to the value the
+    server asked for. `deadline` caps the total time spent on one call,
+    sleeps included.
+
+    Only the `methods` (the idempotent ones by default) are retried
+    automatically; others can opt in per call with `retry=True`.
+
+    Counters of calls, retries and give-ups are kept in `stats`, and
+    `on_retry(attempt, response, error, delay)` is called before every
+    retry, e.g. to feed a metrics system.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        backoff_factor=0.5,
+        max_backoff=30,
+        jitter=True,
+        deadline=None,
+        retry_statuses=(500, 502, 503, 504),
+        methods=("GET", "HEAD", "OPTIONS"),
+        exceptions=(requests.ConnectionError, requests.Timeout),
+        on_retry=None,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+        self.exceptions = exceptions
+        self.on_retry = on_retry
+        self.sleep = sleep
+        self.clock = clock
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def counters(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def backoff(self, attempt, response=None):
+        delay = min(
+            self.max_backoff, self.backoff_factor * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if response is not None:
+            retry_after = parse_retry_after(
+                response.headers.get("Retry-After"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+    def should_retry(self, method, retry=None):
+        if retry is not None:
+            return retry
+        return method.upper() in self.methods
+
+    def call(self, send, method="GET", retry=None):
+        """
+        Calls `send()`, which must return a `requests.Response`, until it
+        succeeds or the attempts or the deadline run out. When they do the
+        last response is returned, or the last exception re-raised.
+        """
+        self.count("calls")
+        if not self.should_retry(method, retry):
+            return send()
+        start = self.clock()
+        attempt = 0
+        while True:
+            attempt += 1
+            response = error = None
+            try:
+                response = send()
+            except self.exceptions as e:
+                error = e
+            if response is not None and (
+                    response.status_code not in self.retry_statuses):
+                return response
+            if response is not None:
+                self.count("status_{}".format(response.status_code))
+            else:
+                self.count("errors")
+            delay = self.backoff(attempt, response)
+            out_of_time = (
+                self.deadline is not None and
+                self.clock() - start + delay > self.deadline)
+            if attempt >= self.max_attempts or out_of_time:
+                self.count("gave_up")
+                if error is not None:
+                    raise error
+                return response
+            self.count("retries")
+            if self.on_retry is not None:
+                self.on_retry(attempt, response, error, delay)
+            if response is not None:
+                response.close()
+            self.sleep(delay)
@@ -1,17 +1,13 @@
-import sys
 from setuptools import setup, find_packages
 
 import bol
 
 # Dynamically calculate the version based on actistream.VERSION.
 VERSION = bol.__version__
-IS_PY2 = sys.version_info[0] < 3
 
 install_requires = [
     'python-dateutil',
     'requests']
-if IS_PY2:
-    install_requires.append('enum34')
 
 setup(name='python-bol-api-latest',
       version=VERSION,
@@ -24,10 +20,9 @@ setup(name='python-bol-api-latest',
           'Topic :: Software Development',
           'Topic :: System',
           'Topic :: System :: Software Distribution',
-          'Programming Language :: Python :: 2',
-          'Programming Language :: Python :: 2.7',
           'Programming Language :: Python :: 3',
-          'Programming Language :: Python :: 3.4',
+          'Programming Language :: Python :: 3 :: Only',
+          'Programming Language :: Python :: 3.6',
           'License :: OSI Approved :: '
           'GNU Lesser General Public License v3 or later (LGPLv3+)',
       ],
@@ -39,5 +34,7 @@ setup(name='python-bol-api-latest',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
       zip_safe=False,
+      python_requires='>=3.6',
       install_requires=install_requires,
+      extras_require={'orjson': ['orjson']},
       entry_points="")
@@ -1,3 +1,7 @@
+import base64
+import hashlib
+import hmac
+import pickle
 import pytest
 
 from decimal import Decimal
@@ -5,8 +9,12 @@ from datetime import datetime
 from dateutil.tz import tzoffset
 
 from bol.plaza.api import PlazaAPI, TransporterCode
+from bol.plaza.models import InventoryOffer, Order, TEXT_FIELD
+from bol.plaza.signing import Signer
+from bol.retry import RetryPolicy
 
 from httmock import HTTMock, urlmatch
+from requests import HTTPError
 
 
 ORDERS_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
@@ -253,7 +261,7 @@ def test_orders():
 def test_order_process():
     @urlmatch(path=r'/services/rest/shipments/v2$')
     def create_shipment_stub(url, request):
-        assert request.body == """<?xml version="1.0" encoding="UTF-8"?>
+        assert request.body == b"""<?xml version="1.0" encoding="UTF-8"?>
 <ShipmentRequest xmlns="https://plazaapi.bol.com/services/xsd/v2/plazaapi.xsd">
     <DateTime>2016-10-01T01:08:17</DateTime>
     <OrderItemId>123</OrderItemId>
@@ -295,7 +303,7 @@ def test_shipments():
 def test_update_transport():
     @urlmatch(path=r'/services/rest/transports/v2/1$')
     def create_transport_stub(url, request):
-        assert request.body == """<?xml version="1.0" encoding="UTF-8"?>
+        assert request.body == b"""<?xml version="1.0" encoding="UTF-8"?>
 <ChangeTransportRequest xmlns=\
 "https://plazaapi.bol.com/services/xsd/v2/plazaapi.xsd">
     <TrackAndTrace>3S123</TrackAndTrace>
@@ -378,6 +386,36 @@ def test_get_inventory():
         assert getattr(offer, "NCK-Stock") == "1"
 
 
+def test_compact_models():
+
+    @urlmatch(path=r'/services/rest/inventory')
+    def inventory_stub(url, request):
+        return INVENTORY_RESPONSE
+
+    with HTTMock(inventory_stub):
+        api = PlazaAPI('api_key', 'api_secret', test=True, compact=True)
+        inventory = api.inventory.getInventory(page=1, quantity="0-250",
+                                               state="saleable",
+                                               query="0042491966861")
+
+        assert inventory.compact
+        assert not hasattr(inventory, 'xml')
+        assert inventory.TotalCount == 144
+        offer = inventory.Offers[0]
+        assert vars(offer) == {}
+        assert offer.Stock == 0
+        assert getattr(offer, "NCK-Stock") == "1"
+        assert type(offer) is type(inventory.Offers[1])
+
+        offer = pickle.loads(pickle.dumps(offer))
+        assert getattr(offer, "NCK-Stock") == "1"
+
+        api = PlazaAPI('api_key', 'api_secret', test=True)
+        inventory = api.inventory.getInventory(page=1)
+        assert type(inventory.Offers[0]) is InventoryOffer
+        assert not inventory.Offers[0].compact
+
+
 SINGLE_BOUND_RESPONSE = """<?xml version="1.0" encoding="UTF-8"
 standalone="yes"?>
 <Inbound xmlns="https://plazaapi.bol.com/services/xsd/v1/plazaapi.xsd">
@@ -737,3 +775,165 @@ def test_handle_return_items():
         assert handle_return_item_process.id, 112748417
         assert handle_return_item_process.eventType == 'HANDLE_RETURN_ITEM'
         assert handle_return_item_process.status == 'PENDING'
+
+
+def test_retry_policy():
+    dates = []
+
+    @urlmatch(path=r'/services/rest/transports/v2/1/shipping-label/2$')
+    def shipping_label_stub(url, request):
+        dates.append(request.headers['X-BOL-Date'])
+        if len(dates) < 3:
+            return {'status_code': 503, 'content': b''}
+        return b'%PDF'
+
+    with HTTMock(shipping_label_stub):
+        policy = RetryPolicy(sleep=lambda delay: None)
+        api = PlazaAPI('api_key', 'api_secret', test=True,
+                       retry_policy=policy)
+        content = api.request(
+            'GET', '/services/rest/transports/v2/1/shipping-label/2',
+            accept='application/pdf')
+        assert content == '%PDF'
+        assert len(dates) == 3
+        assert policy.counters()['retries'] == 2
+
+
+def test_streaming():
+    @urlmatch(path=r'/services/rest/inbounds$')
+    def all_inbound_stub(url, request):
+        return ALL_BOUND_RESPONSE
+
+    @urlmatch(path=r'/services/rest/inventory')
+    def inventory_stub(url, request):
+        return INVENTORY_RESPONSE
+
+    with HTTMock(orders_stub, all_inbound_stub, inventory_stub):
+        api = PlazaAPI('api_key', 'api_secret', test=True)
+        orders = list(api.orders.iter_list())
+        assert len(orders) == 1
+        order = orders[0]
+        assert order.OrderId == '123'
+        assert order.CustomerDetails.ShipmentDetails.Housenumber == 42
+        assert order.OrderItems[0].OfferPrice == Decimal('123.45')
+
+        inbounds = list(api.inbounds.iter_all_inbounds())
+        assert [inbound.Id for inbound in inbounds] == [
+            '1124284930', '1124284929']
+        assert [inbound.Reference for inbound in inbounds] == [
+            'FBB20170726', 'FBB20170712']
+        assert inbounds[0].TimeSlot.Start == datetime(
+            2017, 7, 28, 6, tzinfo=tzoffset(None, 7200))
+
+        api = PlazaAPI('api_key', 'api_secret', test=True, keep_raw=False)
+        offers = api.inventory.iter_inventory(page=1)
+        offer = next(offers)
+        assert offer.Stock == 0
+        assert getattr(offer, "NCK-Stock") == "1"
+        assert [offer.EAN for offer in offers] == [
+            '9789076174198', '9789061697664', '9789061697008',
+            '9781781103524']
+
+
+INVOICE_SPECIFICATION_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<bns:InvoiceSpecifications
+    xmlns:bns="http://plazaapi.bol.com/services/xsd/plazaapiservice-1.0.xsd">
+  <bns:InvoiceSpecification>
+    <bns:Item>
+      <bns:ID>1</bns:ID>
+      <bns:Price>
+        <bns:PriceAmount>12.50</bns:PriceAmount>
+        <bns:BaseQuantity>1</bns:BaseQuantity>
+      </bns:Price>
+    </bns:Item>
+  </bns:InvoiceSpecification>
+  <bns:InvoiceSpecification>
+    <bns:Item>
+      <bns:ID>2</bns:ID>
+      <bns:Price>
+        <bns:PriceAmount>3.95</bns:PriceAmount>
+        <bns:BaseQuantity>2</bns:BaseQuantity>
+      </bns:Price>
+    </bns:Item>
+  </bns:InvoiceSpecification>
+</bns:InvoiceSpecifications>
+"""
+
+
+def test_streaming_invoice_specification():
+    @urlmatch(path=r'/services/rest/invoices/1234/specification$')
+    def specification_stub(url, request):
+        assert url.query == 'page=2'
+        return INVOICE_SPECIFICATION_RESPONSE
+
+    with HTTMock(specification_stub):
+        api = PlazaAPI('api_key', 'api_secret', test=True)
+        specifications = list(api.invoices.iter_specification(1234, page=2))
+    assert [s.Item.Price.PriceAmount for s in specifications] == [
+        Decimal('12.50'), Decimal('3.95')]
+
+
+def test_streaming_errors():
+    @urlmatch(path=r'/services/rest/orders/v2$')
+    def error_stub(url, request):
+        return {'status_code': 500, 'content': b'<error/>'}
+
+    with HTTMock(error_stub):
+        api = PlazaAPI('api_key', 'api_secret', test=True)
+        with pytest.raises(HTTPError):
+            list(api.orders.iter_list())
+        # Non-streamed calls keep reporting failures as `False`
+        assert api.request('GET', '/services/rest/orders/v2') is False
+
+
+def test_tag_table():
+    with HTTMock(orders_stub):
+        api = PlazaAPI('api_key', 'api_secret', test=True)
+        api.orders.list()
+    ns = '{http://plazaapi.bol.com/services/xsd/plazaapiservice-1.0.xsd}'
+    table = Order.tag_table()
+    assert table[ns + 'OrderId'] == ('OrderId', TEXT_FIELD)
+    assert table[ns + 'OrderItems'] == (
+        'OrderItems', Order.Meta.OrderItems)
+
+
+def test_signer():
+    now = [1474200000.25]
+    signer = Signer('api_key', 'api_secret', clock=lambda: now[0])
+    date, signature = signer.sign('GET', '/services/rest/orders/v2')
+    assert date == 'Sun, 18 Sep 2016 12:00:00 GMT'
+    msg = ('GET\n\napplication/xml; charset=UTF-8\n' + date +
+           '\nx-bol-date:' + date + '\n/services/rest/orders/v2')
+    digest = hmac.new(b'api_secret', msg.encode('utf-8'),
+                      hashlib.sha256).digest()
+    assert signature == b'api_key:' + base64.b64encode(digest)
+
+    now[0] += 0.5
+    assert signer.sign('GET', '/services/rest/orders/v2')[1] is signature
+    assert signer.sign('POST', '/services/rest/orders/v2')[1] != signature
+    now[0] += 1
+    date2, signature2 = signer.sign('GET', '/services/rest/orders/v2')
+    assert date2 == 'Sun, 18 Sep 2016 12:00:01 GMT'
+    assert signature2 != signature
+
+
+def test_request_xml_escaping():
+    api = PlazaAPI('api_key', 'api_secret', test=True)
+    xml = api.offers.create_request_offers_xml(
+        'UpsertRequest',
+        RetailerOffer=[
+            {'EAN': '1', 'Description': 'Fish & <Chips>'},
+            {'EAN': '2', 'Description': None, 'Title': u'Caf\xe9'},
+        ])
+    assert xml == b"""<?xml version="1.0" encoding="UTF-8"?>
+<UpsertRequest xmlns="https://plazaapi.bol.com/offers/xsd/api-2.0.xsd">
+    <RetailerOffer>
+        <Description>Fish &amp; &lt;Chips&gt;</Description>
+        <EAN>1</EAN>
+    </RetailerOffer>
+    <RetailerOffer>
+        <EAN>2</EAN>
+        <Title>Caf\xc3\xa9</Title>
+    </RetailerOffer>
+</UpsertRequest>
+"""
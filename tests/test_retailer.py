@@ -0,0 +1,1079 @@
+import asyncio
+import dateutil.parser
+import io
+import json
+import pickle
+import pytest
+import threading
+import time
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from urllib.parse import parse_qsl
+from dateutil.tz import tzoffset
+
+from bol.retailer.api import RetailerAPI
+from bol.retailer.async_api import AsyncRetailerAPI
+from bol.retailer.auth import FileTokenCache, TokenManager
+from bol.retailer.cache import ResponseCache
+from bol.retailer.decoders import JSONDecoder, OrjsonDecoder, orjson
+from bol.retailer.models import Invoice, Order, OrderItem, Orders
+from bol.retailer.offercache import OfferStateCache
+from bol.retailer.ratelimit import RateLimiter
+from bol.retailer.storage import MemoryStore, SQLiteStore
+from bol.retailer.sync import OrderCheckpoint, OrderSync
+from bol.dateparse import parse_datetime
+from bol.retry import RetryPolicy
+
+from httmock import HTTMock, urlmatch
+from requests import HTTPError
+
+
+ORDER_RESPONSE = {
+    "orderId": "1043946570",
+    "pickUpPoint": False,
+    "orderPlacedDateTime": "2019-04-29T16:18:21+02:00",
+    "shipmentDetails": {
+        "salutation": "MALE",
+        "firstName": "Hans",
+        "surname": "de Grote",
+        "streetName": "Skywalkerstraat",
+        "houseNumber": "21",
+        "zipCode": "1234AB",
+        "city": "PLATOONDORP",
+        "countryCode": "NL",
+        "email": "hans@example.com",
+        "language": "nl",
+    },
+    "billingDetails": {
+        "firstName": "Pieter",
+        "surname": "Post",
+        "streetName": "Skywalkerstraat",
+        "houseNumber": "21",
+        "zipCode": "1234AB",
+        "city": "PLATOONDORP",
+        "countryCode": "NL",
+        "email": "pieter@example.com",
+    },
+    "orderItems": [
+        {
+            "orderItemId": "6042823871",
+            "cancellationRequest": False,
+            "fulfilment": {
+                "method": "FBR",
+                "distributionParty": "RETAILER",
+                "latestDeliveryDate": "2019-04-30",
+            },
+            "offer": {"offerId": "8f6183e4", "reference": "REF12345"},
+            "product": {"ean": "8785056370398", "title": "Star Wars"},
+            "quantity": 3,
+            "quantityShipped": 0,
+            "quantityCancelled": 0,
+            "unitPrice": 13.12,
+            "commission": 5.12,
+        }
+    ],
+}
+
+
+def order_response(order_id):
+    order = dict(ORDER_RESPONSE, orderId=order_id)
+    return {
+        "status_code": 200,
+        "content": json.dumps(order).encode("utf-8"),
+    }
+
+
+@urlmatch(path=r"/retailer/orders/(\d+)$")
+def order_stub(url, request):
+    return order_response(url.path.rpartition("/")[2])
+
+
+def test_async_orders_get():
+    async def fetch(api, order_ids):
+        return await asyncio.gather(
+            *[api.orders.get(order_id) for order_id in order_ids]
+        )
+
+    order_ids = [str(1043946570 + i) for i in range(25)]
+    loop = asyncio.new_event_loop()
+    try:
+        with HTTMock(order_stub):
+            api = AsyncRetailerAPI(max_connections=5)
+            orders = loop.run_until_complete(fetch(api, order_ids))
+            api.close()
+    finally:
+        loop.close()
+
+    assert [order.orderId for order in orders] == order_ids
+    assert all(isinstance(order, Order) for order in orders)
+    item = orders[0].orderItems[0]
+    assert item.fulfilment.method == "FBR"
+    assert item.unitPrice == Decimal("13.12")
+
+
+def test_async_wraps_existing_api():
+    api = RetailerAPI(demo=True)
+    async_api = AsyncRetailerAPI(api=api, max_connections=2)
+    assert async_api.sync_api is api
+    assert async_api.orders.methods is api.orders
+    assert async_api.orders.api is async_api
+    async_api.close()
+
+
+def orders_page_stub(total_pages):
+    @urlmatch(path=r"/retailer/orders$")
+    def stub(url, request):
+        page = int(dict(
+            param.split("=") for param in url.query.split("&")
+        ).get("page", 1))
+        orders = []
+        if page <= total_pages:
+            orders = [
+                {"orderId": "{}{}".format(page, i), "orderItems": []}
+                for i in range(3)
+            ]
+        stub.pages.append(page)
+        return {
+            "status_code": 200,
+            "content": json.dumps({"orders": orders}).encode("utf-8"),
+        }
+
+    stub.pages = []
+    return stub
+
+
+def test_orders_iter_list():
+    for prefetch in (False, True):
+        stub = orders_page_stub(3)
+        with HTTMock(stub):
+            api = RetailerAPI()
+            order_ids = [
+                order.orderId
+                for order in api.orders.iter_list(prefetch=prefetch)
+            ]
+        assert order_ids == [
+            "10", "11", "12", "20", "21", "22", "30", "31", "32"]
+        assert sorted(stub.pages) == [1, 2, 3, 4]
+
+
+def test_async_orders_iter_list():
+    async def fetch(api):
+        return [order.orderId async for order in api.orders.iter_list()]
+
+    stub = orders_page_stub(3)
+    loop = asyncio.new_event_loop()
+    try:
+        with HTTMock(stub):
+            api = AsyncRetailerAPI(max_connections=2)
+            order_ids = loop.run_until_complete(fetch(api))
+            api.close()
+    finally:
+        loop.close()
+
+    assert order_ids == [
+        "10", "11", "12", "20", "21", "22", "30", "31", "32"]
+    assert sorted(stub.pages) == [1, 2, 3, 4]
+
+
+def test_orders_get_many():
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def stub(url, request):
+        order_id = url.path.rpartition("/")[2]
+        if order_id == "404":
+            return {"status_code": 404, "content": b"{}"}
+        return order_response(order_id)
+
+    order_ids = [str(i) for i in range(400, 420)]
+    with HTTMock(stub):
+        api = RetailerAPI()
+        results = api.orders.get_many(
+            order_ids, max_workers=4, max_in_flight=5)
+
+    assert [result.id for result in results] == order_ids
+    failed = [result for result in results if not result.ok]
+    assert [result.id for result in failed] == ["404"]
+    assert isinstance(failed[0].error, HTTPError)
+    assert all(
+        result.value.orderId == result.id
+        for result in results if result.ok)
+
+
+def test_rate_limiter_buckets():
+    sleeps = []
+    limiter = RateLimiter(
+        limits={"orders": (2, 1)}, sleep=sleeps.append, clock=lambda: 0)
+    for _ in range(3):
+        limiter.acquire("orders")
+    limiter.acquire("shipments")
+    assert sleeps == [0.5, 1.0]
+
+
+def test_rate_limiter_retry_after():
+    responses = [
+        {"status_code": 429, "headers": {"Retry-After": "3"},
+         "content": b"{}"},
+        order_response("1043946570"),
+    ]
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def stub(url, request):
+        return responses.pop(0)
+
+    sleeps = []
+    limiter = RateLimiter(sleep=sleeps.append, clock=lambda: 0)
+    with HTTMock(stub):
+        api = RetailerAPI(rate_limiter=limiter)
+        order = api.orders.get("1043946570")
+    assert order.orderId == "1043946570"
+    assert sleeps == [3]
+    # halved by the 429, partly restored by the successful retry
+    assert limiter.bucket("orders").rate == 5.5
+
+
+def test_retry_policy():
+    responses = [
+        {"status_code": 503, "content": b"{}"},
+        {"status_code": 502, "content": b"{}"},
+        order_response("1043946570"),
+    ]
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def stub(url, request):
+        return responses.pop(0)
+
+    sleeps = []
+    policy = RetryPolicy(jitter=False, sleep=sleeps.append)
+    with HTTMock(stub):
+        api = RetailerAPI(retry_policy=policy)
+        order = api.orders.get("1043946570")
+    assert order.orderId == "1043946570"
+    assert sleeps == [0.5, 1.0]
+    assert policy.counters() == {
+        "calls": 1, "retries": 2, "status_503": 1, "status_502": 1}
+
+
+def test_retry_policy_opt_in():
+    @urlmatch(path=r"/retailer/orders/cancellation$")
+    def stub(url, request):
+        stub.calls += 1
+        return {"status_code": 503, "content": b"{}"}
+
+    stub.calls = 0
+    policy = RetryPolicy(max_attempts=2, sleep=lambda delay: None)
+    with HTTMock(stub):
+        api = RetailerAPI(retry_policy=policy)
+        with pytest.raises(HTTPError):
+            api.orders.cancel_order_item("123", "OUT_OF_STOCK")
+        assert stub.calls == 1
+        with pytest.raises(HTTPError):
+            api.request(
+                "PUT", "/retailer/orders/cancellation", json={}, retry=True)
+        assert stub.calls == 3
+    assert policy.counters()["gave_up"] == 1
+
+
+def process_status(process_id, status):
+    return {
+        "processStatusId": process_id,
+        "entityId": "987654321",
+        "eventType": "UPDATE_OFFER_PRICE",
+        "status": status,
+        "createTimestamp": "2020-05-01T10:00:00+02:00",
+        "links": [],
+    }
+
+
+class AcceptedRequests(object):
+    """
+    Records what is submitted to a stubbed endpoint, and accepts each
+    submission with a process status, with id "1", "2", ... unless given.
+    """
+
+    def __init__(self):
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def accept(self, submission, status="PENDING", process_id=None,
+               **fields):
+        with self.lock:
+            self.submitted.append(submission)
+            if process_id is None:
+                process_id = str(len(self.submitted))
+        return {
+            "status_code": 202,
+            "content": json.dumps(dict(
+                process_status(process_id, status), **fields
+            )).encode("utf-8"),
+        }
+
+
+def process_status_query_stub(statuses=None, **fields):
+    """
+    Stub of the bulk process status query, answering with the status in
+    `statuses` of every queried id (SUCCESS when it is not in there).
+    """
+    statuses = statuses or {}
+
+    @urlmatch(path=r"/retailer/process-status$", method="POST")
+    def stub(url, request):
+        queries = json.loads(request.body)["processStatusQueries"]
+        return {
+            "status_code": 200,
+            "content": json.dumps({"processStatuses": [
+                dict(process_status(
+                    query["processStatusId"],
+                    statuses.get(query["processStatusId"], "SUCCESS"),
+                ), **fields)
+                for query in queries
+            ]}).encode("utf-8"),
+        }
+
+    return stub
+
+
+def test_process_status_wait_all():
+    # successive statuses reported for each process id
+    statuses = {
+        "1": ["SUCCESS"],
+        "2": ["PENDING", "PENDING", "FAILURE"],
+        "3": ["PENDING", "SUCCESS"],
+    }
+
+    @urlmatch(path=r"/retailer/process-status$", method="POST")
+    def stub(url, request):
+        queries = json.loads(request.body)["processStatusQueries"]
+        process_ids = [query["processStatusId"] for query in queries]
+        stub.requests.append(process_ids)
+        return {
+            "status_code": 200,
+            "content": json.dumps({"processStatuses": [
+                process_status(process_id, statuses[process_id].pop(0))
+                for process_id in process_ids
+            ]}).encode("utf-8"),
+        }
+
+    stub.requests = []
+    with HTTMock(stub):
+        api = RetailerAPI()
+        completed = [
+            (process_status.processStatusId, process_status.status)
+            for process_status in api.process_status.wait_all(
+                ["1", "2", "3"], min_interval=0.001, batch_size=2)
+        ]
+    assert completed == [("1", "SUCCESS"), ("3", "SUCCESS"), ("2", "FAILURE")]
+    assert stub.requests == [["1", "2"], ["3"], ["2", "3"], ["2"]]
+
+
+OFFERS_EXPORT = (
+    "offerId,ean,conditionName,conditionCategory,conditionComment,"
+    "bundlePricesPrice,fulfilmentDeliveryCode,stockAmount,onHoldByRetailer,"
+    "fulfilmentType,mutationDateTime,referenceCode,correctedStock\r\n"
+    "13722de8-8182-d161-5422-4a0a1caab5c8,8718526069334,NEW,NEW,,"
+    "28.00,24uurs-21,5,false,FBR,2021-01-07 12:05:52.0,REF1,5\r\n"
+    "7e4b1d4c-aaf1-4e2c-9a4b-2b5f4f5a8f62,8718526069335,AS_NEW,SECONDHAND,"
+    "\"Krasje op, de zijkant\nverder nieuw\",12.99,1-2d,0,true,FBB,"
+    "2021-01-08 09:00:00.0,,0\r\n"
+).encode("utf-8")
+
+
+def test_offers_iter_offers_file():
+    @urlmatch(path=r"/retailer/offers/export/1234$")
+    def stub(url, request):
+        return {"status_code": 200, "content": OFFERS_EXPORT}
+
+    out = io.BytesIO()
+    with HTTMock(stub):
+        api = RetailerAPI()
+        rows = list(api.offers.iter_offers_file(
+            "1234", write_to=out, chunk_size=7))
+
+    assert out.getvalue() == OFFERS_EXPORT
+    assert len(rows) == 2
+    assert rows[0].ean == "8718526069334"
+    assert rows[0].conditionName == "NEW"
+    assert rows[0].bundlePricesPrice == Decimal("28.00")
+    assert rows[0].stockAmount == 5
+    assert rows[0].onHoldByRetailer is False
+    assert rows[0].fulfilmentType == "FBR"
+    assert rows[0].mutationDateTime == datetime(2021, 1, 7, 12, 5, 52)
+    assert rows[0].conditionComment is None
+    assert rows[1].conditionComment == "Krasje op, de zijkant\nverder nieuw"
+    assert rows[1].onHoldByRetailer is True
+    assert rows[1].referenceCode is None
+
+
+def test_offers_export_all(tmpdir):
+    exports = AcceptedRequests()
+
+    @urlmatch(path=r"/retailer/offers/export$", method="POST")
+    def request_export_stub(url, request):
+        return exports.accept(request.body)
+
+    process_status_stub = process_status_query_stub(entityId="555")
+
+    @urlmatch(path=r"/retailer/offers/export/555$", method="GET")
+    def export_stub(url, request):
+        export_stub.ranges.append(request.headers.get("Range"))
+        return {"status_code": 200, "content": OFFERS_EXPORT}
+
+    export_stub.ranges = []
+    with HTTMock(request_export_stub, process_status_stub, export_stub):
+        api = RetailerAPI()
+        offers = api.offers.export_all(index_by="ean")
+        assert sorted(offers) == ["8718526069334", "8718526069335"]
+        assert offers["8718526069334"].stockAmount == 5
+
+        rows = list(api.offers.export_all(workdir=str(tmpdir)))
+        assert len(rows) == 2
+        assert export_stub.ranges == [None, None]
+        # The finished export is not resumed by the next one
+        assert not tmpdir.join("offers-export.json").exists()
+        rows = list(api.offers.export_all(workdir=str(tmpdir)))
+        assert len(rows) == 2
+        assert len(exports.submitted) == 3
+
+
+def test_offers_export_all_resume(tmpdir):
+    tmpdir.join("offers-export.json").write(json.dumps({
+        "created": time.time(),
+        "process_id": "1",
+        "export_id": "555",
+    }))
+    tmpdir.join("offers-export.csv").write_binary(OFFERS_EXPORT[:100])
+
+    @urlmatch(path=r"/retailer/offers/export/555$", method="GET")
+    def export_stub(url, request):
+        assert request.headers["Range"] == "bytes=100-"
+        return {"status_code": 206, "content": OFFERS_EXPORT[100:]}
+
+    with HTTMock(export_stub):
+        api = RetailerAPI()
+        offers = api.offers.export_all(
+            workdir=str(tmpdir), index_by="offerId")
+    assert len(offers) == 2
+    # The resumed download is read back as a whole
+    offer = offers["7e4b1d4c-aaf1-4e2c-9a4b-2b5f4f5a8f62"]
+    assert offer.conditionComment == "Krasje op, de zijkant\nverder nieuw"
+
+
+def test_offers_bulk_update():
+    updates = AcceptedRequests()
+
+    @urlmatch(path=r"/retailer/offers/([^/]+)/(price|stock)$", method="PUT")
+    def update_stub(url, request):
+        offer_id, kind = url.path.split("/")[-2:]
+        if offer_id == "broken":
+            return {"status_code": 400, "content": b"{}"}
+        return updates.accept(
+            (offer_id, kind, json.loads(request.body)), entityId=offer_id)
+
+    finished = []
+    with HTTMock(update_stub, process_status_query_stub()):
+        api = RetailerAPI()
+        report = api.offers.bulk_update([
+            ("a", {"price": Decimal("10.00")}),
+            ("b", {"stock": 3}),
+            ("a", {"price": Decimal("12.99")}),
+            ("a", {"stock": 1, "managed_by_retailer": True}),
+            ("broken", {"stock": 1}),
+        ], max_workers=3, on_result=finished.append,
+            managed_by_retailer=False)
+
+    assert list(report) == ["a", "b", "broken"]
+    assert sorted(result.offer_id for result in finished) == [
+        "a", "b", "broken"]
+    assert sorted(updates.submitted, key=lambda s: s[:2]) == [
+        ("a", "price", {"pricing": {"bundlePrices": [
+            {"quantity": 1, "unitPrice": 12.99}]}}),
+        ("a", "stock", {"amount": 1, "managedByRetailer": True}),
+        ("b", "stock", {"amount": 3, "managedByRetailer": False}),
+    ]
+    assert report["a"].ok
+    assert report["a"].process_statuses["price"].status == "SUCCESS"
+    assert report["b"].ok
+    assert not report["broken"].ok
+    assert isinstance(report["broken"].errors["stock"], HTTPError)
+
+
+def test_offers_bulk_update_managed_by_retailer():
+    updates = AcceptedRequests()
+
+    @urlmatch(path=r"/retailer/offers/([^/]+)/(price|stock)$", method="PUT")
+    def update_stub(url, request):
+        offer_id, kind = url.path.split("/")[-2:]
+        return updates.accept(
+            (offer_id, kind, json.loads(request.body)), entityId=offer_id)
+
+    cache = OfferStateCache()
+    cache.update("cached", amount=2, managed_by_retailer=True)
+    finished = []
+    with HTTMock(update_stub, process_status_query_stub()):
+        api = RetailerAPI(offer_cache=cache)
+        report = api.offers.bulk_update([
+            ("cached", {"stock": 3}),
+            ("unknown", {"stock": 3}),
+            ("unknown", {"price": Decimal("1.50")}),
+        ], on_result=finished.append)
+
+    assert sorted(updates.submitted, key=lambda s: s[:2]) == [
+        ("cached", "stock", {"amount": 3, "managedByRetailer": True}),
+        ("unknown", "price", {"pricing": {"bundlePrices": [
+            {"quantity": 1, "unitPrice": 1.5}]}}),
+    ]
+    assert report["cached"].ok
+    assert cache.get("cached")["managedByRetailer"] is True
+    # The stock of an offer is not sent without knowing who manages it
+    assert not report["unknown"].ok
+    assert isinstance(report["unknown"].errors["stock"], ValueError)
+    assert report["unknown"].process_statuses["price"].status == "SUCCESS"
+    assert sorted(result.offer_id for result in finished) == [
+        "cached", "unknown"]
+
+
+def shipment_stub(shipments):
+    @urlmatch(path=r"/retailer/orders/shipment$", method="PUT")
+    def stub(url, request):
+        payload = json.loads(request.body)
+        if payload.get("shipmentReference") == "broken":
+            return {"status_code": 400, "content": b"{}"}
+        return shipments.accept(payload)
+
+    return stub
+
+
+def test_orders_ship_many():
+    shipments = AcceptedRequests()
+    submitted = shipments.submitted
+    tnt = {"transporter_code": "TNT", "track_and_trace": "3SAOLD1234567"}
+    finished = []
+    with HTTMock(shipment_stub(shipments), process_status_query_stub()):
+        api = RetailerAPI()
+        api.orders.ship_order_item("11", shipment_reference="ref")
+        assert submitted.pop() == {
+            "orderItems": [{"orderItemId": "11"}],
+            "shipmentReference": "ref",
+        }
+
+        report = api.orders.ship_many([
+            dict(tnt, order_item_id="1", order_id="A"),
+            dict(tnt, order_item_id="2", order_id="B"),
+            dict(tnt, order_item_id="3", order_id="A"),
+            {"order_item_id": "4", "order_id": "A",
+             "shipping_label_id": "label"},
+            dict(tnt, order_item_id="5"),
+            {"order_item_id": "6", "shipment_reference": "broken"},
+        ], max_workers=3, on_result=finished.append)
+
+    assert list(report) == ["1", "3", "2", "4", "5", "6"]
+    assert report["1"] is report["3"]
+    assert len(finished) == 5
+    transport = {"transporterCode": "TNT", "trackAndTrace": "3SAOLD1234567"}
+    submitted.sort(key=lambda p: p["orderItems"][0]["orderItemId"])
+    assert submitted == [
+        {"orderItems": [{"orderItemId": "1"}, {"orderItemId": "3"}],
+         "transport": transport},
+        {"orderItems": [{"orderItemId": "2"}], "transport": transport},
+        {"orderItems": [{"orderItemId": "4"}], "shippingLabelId": "label"},
+        {"orderItems": [{"orderItemId": "5"}], "transport": transport},
+    ]
+    assert report["3"].ok
+    assert report["3"].process_status.status == "SUCCESS"
+    assert not report["6"].ok
+    assert isinstance(report["6"].error, HTTPError)
+
+
+def test_orders_cancel_many():
+    cancellations = AcceptedRequests()
+    submitted = cancellations.submitted
+
+    @urlmatch(path=r"/retailer/orders/cancellation$", method="PUT")
+    def cancellation_stub(url, request):
+        return cancellations.accept(
+            json.loads(request.body)["orderItems"], status="SUCCESS")
+
+    with HTTMock(cancellation_stub):
+        api = RetailerAPI()
+        with pytest.raises(ValueError):
+            api.orders.cancel_many([("1", "OUT_OF_STOCK"), ("2", "SOLD")])
+        assert submitted == []
+
+        report = api.orders.cancel_many(
+            [(str(i), "OUT_OF_STOCK") for i in range(7)] +
+            [("3", "TECH_ISSUE")],
+            max_items=3)
+        assert list(report) == ["0", "1", "2", "4", "5", "6", "3"]
+        assert report["0"] is report["2"]
+        assert report["3"].reason_codes == {"3": "TECH_ISSUE"}
+        assert all(result.ok for result in report.values())
+        assert sorted(len(items) for items in submitted) == [1, 3, 3]
+
+        del submitted[:]
+        api.orders.cancel_many(
+            [("1", "OUT_OF_STOCK", "A"), ("2", "OUT_OF_STOCK", "B"),
+             ("3", "OUT_OF_STOCK", "A")],
+            group_by_order=True)
+        assert sorted(
+            [item["orderItemId"] for item in items] for items in submitted
+        ) == [["1", "3"], ["2"]]
+
+
+def test_offers_bulk_update_timeout():
+    updates = AcceptedRequests()
+
+    @urlmatch(path=r"/retailer/offers/([^/]+)/stock$", method="PUT")
+    def update_stub(url, request):
+        offer_id = url.path.split("/")[-2]
+        status = "PENDING" if offer_id == "slow" else "SUCCESS"
+        return updates.accept(offer_id, status=status, process_id=offer_id)
+
+    finished = []
+    with HTTMock(update_stub,
+                 process_status_query_stub({"slow": "PENDING"})):
+        report = RetailerAPI().offers.bulk_update(
+            [("fast", {"stock": 1}), ("slow", {"stock": 2})],
+            timeout=0.5, on_result=finished.append,
+            managed_by_retailer=False)
+
+    assert report["fast"].ok
+    assert not report["slow"].ok
+    assert report["slow"].process_statuses["stock"].status == "PENDING"
+    assert sorted(result.offer_id for result in finished) == [
+        "fast", "slow"]
+
+
+def test_orders_ship_many_timeout():
+    shipments = AcceptedRequests()
+    finished = []
+    with HTTMock(shipment_stub(shipments),
+                 process_status_query_stub({"2": "PENDING"})):
+        report = RetailerAPI().orders.ship_many(
+            [{"order_item_id": "1", "order_id": "A"},
+             {"order_item_id": "2", "order_id": "B"}],
+            max_workers=1, timeout=0.5, on_result=finished.append)
+
+    assert report["1"].ok
+    assert not report["2"].ok
+    assert report["2"].process_status.status == "PENDING"
+    assert len(finished) == 2
+
+
+def test_storage_ttl(tmpdir):
+    now = [0]
+    stores = [
+        MemoryStore(maxsize=2, clock=lambda: now[0]),
+        SQLiteStore(str(tmpdir.join("store.db")), clock=lambda: now[0]),
+    ]
+    for store in stores:
+        store.set("a", {"amount": 1}, ttl=10)
+        store.set("b", Decimal("1.50"))
+        assert store.get("a") == {"amount": 1}
+        assert store.get("b") == Decimal("1.50")
+        now[0] = 11
+        assert store.get("a") is None
+        assert store.get("b") == Decimal("1.50")
+        now[0] = 0
+    stores[0].set("a", 1)
+    stores[0].set("c", 3)
+    assert stores[0].get("b") is None
+
+
+def test_offer_cache_skips_unchanged_updates():
+    @urlmatch(path=r"/retailer/offers/abc$", method="GET")
+    def offer_stub(url, request):
+        return {
+            "status_code": 200,
+            "content": json.dumps({
+                "offerId": "abc",
+                "ean": "8718526069334",
+                "pricing": {
+                    "bundlePrices": [{"quantity": 1, "unitPrice": 9.99}]},
+                "stock": {"amount": 6, "managedByRetailer": False},
+            }).encode("utf-8"),
+        }
+
+    @urlmatch(path=r"/retailer/offers/abc/(price|stock)$", method="PUT")
+    def update_stub(url, request):
+        update_stub.calls.append(url.path)
+        return {
+            "status_code": 202,
+            "content": json.dumps(
+                process_status("1", "PENDING")).encode("utf-8"),
+        }
+
+    update_stub.calls = []
+    price = {"pricing": {"bundlePrices": [
+        {"quantity": 1, "unitPrice": 9.99}]}}
+    stock = {"amount": 6, "managedByRetailer": False}
+    with HTTMock(offer_stub, update_stub):
+        api = RetailerAPI(offer_cache=OfferStateCache())
+        api.offers.getSingleOffer("abc")
+        assert api.offers.updateProductPrice("abc", price) is None
+        assert api.offers.updateProductStock("abc", stock) is None
+        assert update_stub.calls == []
+
+        assert api.offers.updateProductStock(
+            "abc", dict(stock, amount=5)) is not None
+        # the state is unknown until the update succeeded
+        assert api.offers.updateProductStock(
+            "abc", dict(stock, amount=5)) is not None
+        assert api.offers.updateProductPrice("abc", price) is None
+        assert update_stub.calls == ["/retailer/offers/abc/stock"] * 2
+
+
+def test_offer_cache_expires_fields_separately():
+    now = [0]
+
+    def clock():
+        return now[0]
+
+    cache = OfferStateCache(MemoryStore(clock=clock), ttl=10, clock=clock)
+    cache.update("abc", bundle_prices=[{"quantity": 1, "unitPrice": 9.99}])
+    now[0] = 6
+    cache.update("abc", amount=6, managed_by_retailer=False)
+    now[0] = 8
+    cache.invalidate("abc", "managedByRetailer")
+    assert sorted(cache.get("abc")) == ["amount", "bundlePrices"]
+
+    # Updating the stock did not refresh the price
+    now[0] = 11
+    assert cache.get("abc") == {"amount": 6}
+    cache.update("abc", bundle_prices=[{"quantity": 1, "unitPrice": 8}])
+    now[0] = 17
+    assert cache.get("abc") == {"bundlePrices": [(1, Decimal("8"))]}
+    now[0] = 21
+    assert cache.get("abc") == {}
+
+
+def test_model_field_table():
+    fields = Order.fields()
+    assert sorted(fields) == [
+        "billingDetails", "orderItems", "orderPlacedDateTime",
+        "shipmentDetails"]
+    assert Order.fields() is fields
+    assert OrderItem.fields() is not fields
+
+    order = Order.parse(None, json.dumps(ORDER_RESPONSE))
+    assert order.pickUpPoint is False
+    assert order.orderPlacedDateTime == datetime(
+        2019, 4, 29, 16, 18, 21, tzinfo=tzoffset(None, 7200))
+    assert order.orderItems[0].offer.reference == "REF12345"
+    assert order.raw_data["orderId"] == "1043946570"
+
+
+def test_compact_models():
+    api = RetailerAPI(compact=True)
+    order = Order.parse(api, json.dumps(ORDER_RESPONSE))
+    assert isinstance(order, Order)
+    assert order.compact
+    assert vars(order) == {}
+    assert not hasattr(order, "raw_data")
+    assert order.orderId == "1043946570"
+    assert order.orderItems[0].offer.reference == "REF12345"
+    assert order.orderPlacedDateTime == datetime(
+        2019, 4, 29, 16, 18, 21, tzinfo=tzoffset(None, 7200))
+
+    # Objects of the same shape share one generated class
+    other = Order.parse(api, ORDER_RESPONSE)
+    assert type(other) is type(order)
+    # Attributes outside the shape go to a dict, created on demand
+    other.foo = 1
+    assert vars(other) == {"foo": 1}
+
+    copy = pickle.loads(pickle.dumps(order))
+    assert isinstance(copy, Order)
+    assert copy.orderItems[0].offer.reference == "REF12345"
+
+    api = RetailerAPI(compact=True, keep_raw=True)
+    order = Order.parse(api, json.dumps(ORDER_RESPONSE))
+    assert order.compact
+    assert order.raw_data["orderId"] == "1043946570"
+
+    orders = Orders.parse(
+        RetailerAPI(compact=True), {"orders": [ORDER_RESPONSE]})
+    assert orders[0].orderId == "1043946570"
+    assert not hasattr(orders, "raw_data")
+
+    order = Order.parse(RetailerAPI(), ORDER_RESPONSE)
+    assert type(order) is Order
+    assert not order.compact
+
+
+def test_keep_raw_opt_out():
+    api = RetailerAPI()
+    lean = api.with_options(keep_raw=False)
+    assert lean.session is api.session
+    assert lean.orders.api is lean
+    assert api.keep_raw is None
+
+    with HTTMock(order_stub):
+        order = lean.orders.get("1043946570")
+    assert not hasattr(order, "raw_data")
+    assert not hasattr(order.orderItems[0], "raw_data")
+    raw = order.raw
+    assert raw["orderId"] == "1043946570"
+    assert raw["orderPlacedDateTime"] == "2019-04-29T16:18:21+02:00"
+    assert raw["orderItems"][0]["offer"]["reference"] == "REF12345"
+
+    with HTTMock(order_stub):
+        order = api.orders.get("1043946570")
+    assert order.raw is order.raw_data
+
+    with pytest.raises(TypeError):
+        api.with_options(timeout=3)
+
+
+@pytest.mark.parametrize("text", [
+    "2019-04-29T16:18:21+02:00",
+    "2019-04-29T16:18:21.5+02:00",
+    "2019-04-29T16:18:21.123456-01:30",
+    "2019-04-29T16:18:21+0200",
+    "2019-04-29T16:18:21Z",
+    "2019-04-29T16:18:21",
+    "2019-04-29 16:18",
+    "2019-04-29",
+    "29 April 2019 16:18",
+])
+def test_parse_datetime(text):
+    assert parse_datetime(text) == dateutil.parser.parse(text)
+    assert parse_datetime(text).utcoffset() == \
+        dateutil.parser.parse(text).utcoffset()
+
+
+def test_parse_datetime_offset_only():
+    assert parse_datetime("2016-09-19+02:00") == datetime(
+        2016, 9, 19, tzinfo=tzoffset(None, 7200))
+
+
+def test_decoders():
+    content = json.dumps(ORDER_RESPONSE).encode("utf-8")
+    decoders = [None, JSONDecoder(parse_float=float)]
+    if orjson is not None:
+        decoders.append(OrjsonDecoder())
+    for decoder in decoders:
+        api = RetailerAPI(decoder=decoder)
+        order = Order.parse(api, content)
+        item = order.orderItems[0]
+        assert item.unitPrice == Decimal("13.12")
+        assert item.commission == Decimal("5.12")
+        assert order.raw_content == content.decode("utf-8")
+        # Undeclared numbers are left as decoded
+        raw_price = order.raw_data["orderItems"][0]["unitPrice"]
+        assert type(raw_price) is (float if decoder else Decimal)
+
+    # The default keeps the scale of amounts in undeclared fields too
+    invoice = Invoice.parse(RetailerAPI(), b'{"amount": {"value": 12.90}}')
+    assert str(invoice.raw_data["amount"]["value"]) == "12.90"
+
+
+def test_lazy_models():
+    for api in (RetailerAPI(lazy=True),
+                RetailerAPI(lazy=True, compact=True)):
+        orders = Orders.parse(api, json.dumps({"orders": [ORDER_RESPONSE]}))
+        order = orders[0]
+        assert order.orderId == "1043946570"
+        api_, pending = order._pending
+        assert sorted(pending) == [
+            "billingDetails", "orderItems", "orderPlacedDateTime",
+            "shipmentDetails"]
+
+        item = order.orderItems[0]
+        assert "orderItems" not in pending
+        assert item.unitPrice == Decimal("13.12")
+        assert item.offer.reference == "REF12345"
+        assert order.orderPlacedDateTime == datetime(
+            2019, 4, 29, 16, 18, 21, tzinfo=tzoffset(None, 7200))
+        with pytest.raises(AttributeError):
+            order.foo
+
+        copy = pickle.loads(pickle.dumps(order))
+        assert copy.shipmentDetails.email == "hans@example.com"
+        assert not hasattr(copy, "_pending")
+
+
+def test_token_manager(tmpdir):
+    now = [1000.0]
+    tokens = []
+    revoked = set()
+
+    @urlmatch(netloc=r"login\.bol\.com", path=r"/token$")
+    def token_stub(url, request):
+        time.sleep(0.01)
+        tokens.append("token-{}".format(len(tokens)))
+        return {"status_code": 200,
+                "content": {"access_token": tokens[-1], "expires_in": 299}}
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def authorized_order_stub(url, request):
+        token = request.headers["Authorization"].partition(" ")[2]
+        if token != tokens[-1] or token in revoked:
+            return {"status_code": 401, "content": b""}
+        return order_stub(url, request)
+
+    cache = FileTokenCache(str(tmpdir.join("token.json")))
+
+    def manager():
+        return TokenManager(cache=cache, clock=lambda: now[0])
+
+    with HTTMock(token_stub, authorized_order_stub):
+        api = RetailerAPI(token_manager=manager())
+        assert api.login("id", "secret")["access_token"] == "token-0"
+        api.orders.get("1")
+
+        # Other processes share the cached token
+        other = RetailerAPI(token_manager=manager())
+        other.login("id", "secret")
+        other.orders.get("1")
+        assert tokens == ["token-0"]
+
+        # Refreshed ahead of expiry
+        now[0] += 280
+        api.orders.get("1")
+        assert tokens == ["token-0", "token-1"]
+
+        # A rejected token is replaced once, by concurrent requests too
+        revoked.add("token-1")
+        threads = [
+            threading.Thread(target=api.orders.get, args=(str(i),))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert tokens == ["token-0", "token-1", "token-2"]
+        other.orders.get("1")
+        assert tokens == ["token-0", "token-1", "token-2"]
+
+
+def test_refresh_access_token():
+    now = [1000.0]
+    grants = []
+
+    @urlmatch(netloc=r"login\.bol\.com", path=r"/token$")
+    def token_stub(url, request):
+        params = dict(parse_qsl(url.query))
+        grants.append((params["grant_type"], params["refresh_token"]))
+        n = len(grants)
+        return {"status_code": 200,
+                "content": {"access_token": "token-{}".format(n),
+                            "refresh_token": "refresh-{}".format(n),
+                            "expires_in": 299}}
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def authorized_order_stub(url, request):
+        token = request.headers["Authorization"].partition(" ")[2]
+        if token != "token-{}".format(len(grants)):
+            return {"status_code": 401, "content": b""}
+        return order_stub(url, request)
+
+    with HTTMock(token_stub, authorized_order_stub):
+        api = RetailerAPI(
+            refresh_token="refresh-0",
+            token_manager=TokenManager(clock=lambda: now[0]))
+        token = api.refresh_access_token("id", "secret")
+        assert token["access_token"] == "token-1"
+        assert api.refresh_token == "refresh-1"
+        api.orders.get("1")
+
+        # Renewed with the refresh token handed out last
+        now[0] += 280
+        api.orders.get("1")
+        assert grants == [
+            ("refresh_token", "refresh-0"), ("refresh_token", "refresh-1")]
+        assert api.refresh_token == "refresh-2"
+
+
+def test_response_cache(tmpdir):
+    now = [1000.0]
+    requests_seen = []
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def etag_order_stub(url, request):
+        requests_seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return {"status_code": 304, "content": b""}
+        return dict(order_response(url.path.rpartition("/")[2]),
+                    headers={"ETag": '"v1"'})
+
+    for store in (None, SQLiteStore(str(tmpdir.join("responses.db")))):
+        del requests_seen[:]
+        cache = ResponseCache(store, ttls={"orders": 60},
+                              clock=lambda: now[0])
+        api = RetailerAPI(response_cache=cache)
+        with HTTMock(etag_order_stub):
+            first = api.orders.get("1043946570")
+            second = api.orders.get("1043946570")
+            assert second.orderId == first.orderId == "1043946570"
+            assert requests_seen == [None]
+
+            now[0] += 61
+            third = api.orders.get("1043946570")
+            assert third.orderItems[0].offer.reference == "REF12345"
+            assert requests_seen == [None, '"v1"']
+
+            api.orders.get("1043946571")
+        assert cache.stats() == {
+            "hits": 1, "misses": 2, "revalidated": 1, "stored": 2}
+
+
+ORDERS_PLACED = {
+    "1": "2019-10-27T02:30:00+01:00",
+    "2": "2019-10-27T02:45:00+02:00",
+    "3": "2019-10-27T02:30:00+01:00",
+    "4": "2019-10-28T09:00:00+01:00",
+}
+
+
+def test_order_sync(tmpdir):
+    def listed(order_id, quantity=1):
+        return {
+            "orderId": order_id,
+            "orderPlacedDateTime": ORDERS_PLACED[order_id],
+            "orderItems": [{"orderItemId": order_id + "1",
+                            "quantity": quantity}],
+        }
+
+    pages = {"orders": [[listed("3"), listed("2")], [listed("1")]],
+             "shipments": [[{"shipmentId": 9, "order": {"orderId": "1"}}]]}
+    requested = []
+
+    @urlmatch(path=r"/retailer/(orders|shipments)$")
+    def list_stub(url, request):
+        group = url.path.rpartition("/")[2]
+        page = int(dict(p.split("=") for p in url.query.split("&"))["page"])
+        requested.append((group, page))
+        items = (pages[group] + [[]] * 3)[page - 1]
+        return {"status_code": 200,
+                "content": json.dumps({group: items}).encode("utf-8")}
+
+    @urlmatch(path=r"/retailer/orders/(\d+)$")
+    def placed_order_stub(url, request):
+        order_id = url.path.rpartition("/")[2]
+        order = dict(ORDER_RESPONSE, orderId=order_id,
+                     orderPlacedDateTime=ORDERS_PLACED[order_id])
+        return {"status_code": 200,
+                "content": json.dumps(order).encode("utf-8")}
+
+    api = RetailerAPI()
+    checkpoint = OrderCheckpoint(str(tmpdir.join("orders.db")))
+    sync = OrderSync(api, checkpoint)
+    with HTTMock(list_stub, placed_order_stub):
+        events = [(e.kind, e.order_id) for e in sync.run()]
+        assert events == [("new", "3"), ("new", "2"), ("new", "1"),
+                          ("shipped", "1")]
+        # Compared as points in time, not as text
+        assert checkpoint.high_water_mark == datetime(
+            2019, 10, 27, 1, 30, tzinfo=timezone.utc)
+
+        # Paging stops at the first page without unknown ids
+        del requested[:]
+        pages["orders"][0] = [listed("4"), listed("3", quantity=2)]
+        events = [(e.kind, e.order_id) for e in sync.run()]
+        assert events == [("new", "4"), ("changed", "3")]
+        assert requested == [("orders", 1), ("orders", 2), ("shipments", 1)]
+
+        del requested[:]
+        assert list(OrderSync(api, checkpoint).run(full=True)) == []
+        assert requested == [("orders", 1), ("orders", 2), ("orders", 3),
+                             ("shipments", 1), ("shipments", 2)]